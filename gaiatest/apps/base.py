@@ -2,96 +2,45 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import time
-
 from marionette.errors import NoSuchElementException
 from marionette.errors import ElementNotVisibleException
-from marionette.errors import TimeoutException
-from marionette.errors import StaleElementException
 
 from gaiatest import GaiaApps
+from gaiatest import Wait
 
 
 class Base(object):
-    # deafult timeout in seconds for the wait_for methods
-    _default_timeout = 30
+
+    __slots__ = ('marionette', '_apps')
 
     def __init__(self, marionette):
         self.marionette = marionette
-        self.apps = GaiaApps(self.marionette)
+        self._apps = None
+
+    @property
+    def apps(self):
+        if self._apps is None:
+            self._apps = GaiaApps(self.marionette)
+        return self._apps
 
     def launch(self):
         self.app = self.apps.launch(self.name)
 
-    def wait_for_element_present(self, by, locator, timeout=_default_timeout):
-        timeout = float(timeout) + time.time()
-
-        while time.time() < timeout:
-            time.sleep(0.5)
-            try:
-                return self.marionette.find_element(by, locator)
-            except NoSuchElementException:
-                pass
-        else:
-            raise TimeoutException(
-                'Element %s not found before timeout' % locator)
-
-    def wait_for_element_not_present(self, by, locator, timeout=_default_timeout):
-        timeout = float(timeout) + time.time()
-
-        while time.time() < timeout:
-            time.sleep(0.5)
-            try:
-                self.marionette.find_element(by, locator)
-            except NoSuchElementException:
-                break
-        else:
-            raise TimeoutException(
-                'Element %s still present after timeout' % locator)
-
-    def wait_for_element_displayed(self, by, locator, timeout=_default_timeout):
-        timeout = float(timeout) + time.time()
-
-        while time.time() < timeout:
-            time.sleep(0.5)
-            try:
-                if self.marionette.find_element(by, locator).is_displayed():
-                    break
-            except (NoSuchElementException, StaleElementException):
-                pass
-        else:
-            raise TimeoutException(
-                'Element %s not visible before timeout' % locator)
-
-    def wait_for_element_not_displayed(self, by, locator, timeout=_default_timeout):
-        timeout = float(timeout) + time.time()
-
-        while time.time() < timeout:
-            time.sleep(0.5)
-            try:
-                if not self.marionette.find_element(by, locator).is_displayed():
-                    break
-            except StaleElementException:
-                pass
-            except NoSuchElementException:
-                break
-        else:
-            raise TimeoutException(
-                'Element %s still visible after timeout' % locator)
+    def wait_for_element_present(self, by, locator, timeout=None, interval=None):
+        return Wait(self.marionette, timeout, interval).for_element_present(by, locator)
 
-    def wait_for_condition(self, method, timeout=_default_timeout, message="Condition timed out"):
+    def wait_for_element_not_present(self, by, locator, timeout=None, interval=None):
+        Wait(self.marionette, timeout, interval).for_element_not_present(by, locator)
+
+    def wait_for_element_displayed(self, by, locator, timeout=None, interval=None):
+        Wait(self.marionette, timeout, interval).for_element_displayed(by, locator)
+
+    def wait_for_element_not_displayed(self, by, locator, timeout=None, interval=None):
+        Wait(self.marionette, timeout, interval).for_element_not_displayed(by, locator)
+
+    def wait_for_condition(self, method, timeout=None, message="Condition timed out", interval=None):
         """Calls the method provided with the driver as an argument until the return value is not False."""
-        end_time = time.time() + timeout
-        while time.time() < end_time:
-            try:
-                value = method(self.marionette)
-                if value:
-                    return value
-            except (NoSuchElementException, StaleElementException):
-                pass
-            time.sleep(0.5)
-        else:
-            raise TimeoutException(message)
+        return Wait(self.marionette, timeout, interval).until(method, message)
 
     def is_element_present(self, by, locator):
         try:
@@ -131,6 +80,164 @@ class Base(object):
 
 
 class PageRegion(Base):
-    def __init__(self, marionette, element):
+    """A part of a page, such as a row of a list, found under root_element.
+
+    Regions declare the values they show in `_fields`, as name: (locator,
+    property) where property is 'text', 'selected' or the name of an
+    attribute, and read them from the page each time. snapshot() reads these
+    for every region matching a locator in a single script, giving a
+    RegionSnapshot of each. Regions share the helpers of the page they are on.
+    """
+
+    __slots__ = ('root_element', '_page')
+
+    _fields = {}
+
+    # reads the fields of every element matching a css selector; text is read
+    # as shown, like the text of an element, leaving out hidden descendants,
+    # putting blocks on lines of their own and collapsing whitespace
+    _snapshot_script = """
+var roots = (arguments[2] || document).querySelectorAll(arguments[0]);
+var fields = arguments[1];
+
+function visibleText(aElement) {
+  var text = '';
+  (function walk(aNode) {
+    if (aNode.nodeType == Node.TEXT_NODE) {
+      if (window.getComputedStyle(aNode.parentNode).visibility != 'hidden') {
+        text += aNode.data;
+      }
+      return;
+    }
+    if (aNode.nodeType != Node.ELEMENT_NODE) {
+      return;
+    }
+    var style = window.getComputedStyle(aNode);
+    if (style.display == 'none' || style.opacity == '0') {
+      return;
+    }
+    var block = style.display.indexOf('inline') != 0;
+    if (block) {
+      text += '\\n';
+    }
+    Array.forEach(aNode.childNodes, walk);
+    if (block) {
+      text += '\\n';
+    }
+  })(aElement);
+  return text.split('\\n').map(function(aLine) {
+    return aLine.replace(/\\s+/g, ' ').trim();
+  }).filter(function(aLine) {
+    return aLine;
+  }).join('\\n');
+}
+
+return Array.map(roots, function(root) {
+  var values = {};
+  fields.forEach(function(field) {
+    var element = root.querySelector(field[1]);
+    if (!element) {
+      return;
+    }
+    if (field[2] == 'text') {
+      values[field[0]] = visibleText(element);
+    } else if (field[2] == 'selected') {
+      values[field[0]] = !!(element.checked || element.selected);
+    } else {
+      values[field[0]] = element.getAttribute(field[2]);
+    }
+  });
+  return [root, values];
+});
+"""
+
+    _css_selectors = {'css selector': '%s', 'id': '#%s', 'class name': '.%s', 'tag name': '%s'}
+
+    def __init__(self, marionette, element, page=None):
         self.root_element = element
+        self._page = page
         Base.__init__(self, marionette)
+
+    @property
+    def apps(self):
+        if self._page is not None:
+            return self._page.apps
+        return Base.apps.fget(self)
+
+    def _field(self, name):
+        locator, prop = self._fields[name]
+        element = self.root_element.find_element(*locator)
+        if prop == 'text':
+            return element.text
+        if prop == 'selected':
+            return element.is_selected()
+        return element.get_attribute(prop)
+
+    @classmethod
+    def snapshot(cls, page, by, locator, root=None):
+        """Returns snapshots of the regions of the page matching the locator,
+        with the values of their fields read in the same script."""
+        fields = [[name, cls._css_selectors[field_by] % field_locator, prop]
+                  for name, ((field_by, field_locator), prop) in cls._fields.items()]
+        return PageRegionList(cls, page, page.marionette.execute_script(
+            cls._snapshot_script, [cls._css_selectors[by] % locator, fields, root]))
+
+
+class RegionSnapshot(object):
+    """The values of the fields of a region as read by PageRegion.snapshot.
+
+    The values do not change once read; take a new snapshot to see changes
+    on the page. Properties of the region are worked out from the values,
+    anything else, such as its actions, goes to the region itself, which is
+    also given by region.
+    """
+
+    __slots__ = ('region', '_values')
+
+    def __init__(self, region, values):
+        object.__setattr__(self, 'region', region)
+        object.__setattr__(self, '_values', values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is a snapshot and cannot be changed' % self.region.__class__.__name__)
+
+    def __getattr__(self, name):
+        # the properties a region adds to PageRegion read its fields
+        attribute = getattr(self.region.__class__, name, None)
+        if isinstance(attribute, property) and not hasattr(PageRegion, name):
+            return attribute.fget(self)
+        return getattr(self.region, name)
+
+    def _field(self, name):
+        if name in self._values:
+            return self._values[name]
+        # the element of the field was not there when the snapshot was taken
+        return self.region._field(name)
+
+
+class PageRegionList(object):
+    """The snapshots of the regions of a list, created only as they are
+    indexed or iterated."""
+
+    __slots__ = ('_region', '_page', '_rows')
+
+    def __init__(self, region, page, rows):
+        self._region = region
+        self._page = page
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._create(row) for row in self._rows[index]]
+        return self._create(self._rows[index])
+
+    def __iter__(self):
+        for row in self._rows:
+            yield self._create(row)
+
+    def _create(self, row):
+        element, values = row
+        return RegionSnapshot(self._region(self._page.marionette, element, self._page), values)
@@ -143,8 +143,7 @@ class Browser(Base):
 
     @property
     def tabs(self):
-        return [self.Tab(marionette=self.marionette, element=tab)
-                for tab in self.marionette.find_elements(*self._tabs_list_locator)]
+        return self.Tab.snapshot(self, *self._tabs_list_locator)
 
     @property
     def _current_screen(self):
@@ -152,6 +151,8 @@ class Browser(Base):
 
     class Tab(PageRegion):
 
+        __slots__ = ()
+
         def tap_tab(self):
             # TODO: Bug 876411 - Click works but tap does not on tabs on browser app
             self.root_element.click()
@@ -44,7 +44,7 @@ class Clock(Base):
 
     @property
     def alarms(self):
-        return [self.Alarm(self.marionette, alarm) for alarm in self.marionette.find_elements(*self._all_alarms_locator)]
+        return self.Alarm.snapshot(self, *self._all_alarms_locator)
 
     def wait_for_new_alarm_button(self):
         self.wait_for_element_displayed(*self._alarm_create_new_locator)
@@ -73,23 +73,29 @@ class Clock(Base):
 
     class Alarm(PageRegion):
 
+        __slots__ = ()
+
         _label_locator = ('css selector', 'div.label')
         _time_locator = ('css selector', 'div.alarmList-time')
         _tap_locator = ('id', 'alarm-item')
         _check_box_locator = ('id', 'input-enable')
         _enable_button_locator = ('css selector', 'label.alarmList')
 
+        _fields = {'label': (_label_locator, 'text'),
+                   'time': (_time_locator, 'text'),
+                   'is_alarm_active': (_check_box_locator, 'selected')}
+
         @property
         def label(self):
-            return self.root_element.find_element(*self._label_locator).text
+            return self._field('label')
 
         @property
         def time(self):
-            return self.root_element.find_element(*self._time_locator).text
+            return self._field('time')
 
         @property
         def is_alarm_active(self):
-            return self.root_element.find_element(*self._check_box_locator).is_selected()
+            return self._field('is_alarm_active')
 
         def tap_checkbox(self):
             self.root_element.find_element(*self._enable_button_locator).tap()
@@ -25,8 +25,7 @@ class Contacts(Base):
     @property
     def contacts(self):
         self.wait_for_element_displayed(*self._new_contact_button_locator)
-        return [self.Contact(marionette=self.marionette, element=contact)
-                for contact in self.marionette.find_elements(*self._contact_locator)]
+        return self.Contact.snapshot(self, *self._contact_locator)
 
     def contact(self, name):
         for contact in self.contacts:
@@ -50,16 +49,21 @@ class Contacts(Base):
 
     class Contact(PageRegion):
 
+        __slots__ = ()
+
         _name_locator = ('css selector', 'p > strong')
         _full_name_locator = ('css selector', 'p')
 
+        _fields = {'name': (_name_locator, 'text'),
+                   'full_name': (_full_name_locator, 'text')}
+
         @property
         def name(self):
-            return self.root_element.find_element(*self._name_locator).text
+            return self._field('name')
 
         @property
         def full_name(self):
-            return self.root_element.find_element(*self._full_name_locator).text
+            return self._field('full_name')
 
         def tap(self):
             self.root_element.tap()
@@ -76,7 +76,7 @@ class Email(Base):
 
     @property
     def mails(self):
-        return [Message(self.marionette, mail) for mail in self.marionette.find_elements(*self._email_locator)]
+        return Message.snapshot(self, *self._email_locator)
 
     def wait_for_emails_to_sync(self):
         self.wait_for_element_not_displayed(*self._syncing_locator)
@@ -151,11 +151,16 @@ class ToolBar(Base):
 
 
 class Message(PageRegion):
+
+    __slots__ = ()
+
     _subject_locator = ('css selector', '.msg-header-subject')
 
+    _fields = {'subject': (_subject_locator, 'text')}
+
     @property
     def subject(self):
-        return self.root_element.find_element(*self._subject_locator).text
+        return self._field('subject')
 
     def tap_subject(self):
         el = self.root_element.find_element(*self._subject_locator)
@@ -16,9 +16,12 @@ class Settings(Base):
 
     @property
     def email_accounts(self):
-        return [self.Account(self.marionette, email_account) for email_account in self.marionette.find_elements(*self._email_account_locator)]
+        return self.Account.snapshot(self, *self._email_account_locator)
 
     class Account(PageRegion):
+
+        __slots__ = ()
+
         _name_locator = ('css selector', 'a.tng-account-item-label')
 
         def tap(self):
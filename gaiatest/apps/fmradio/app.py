@@ -58,15 +58,20 @@ class FmRadio(Base):
 
     @property
     def favorite_channels(self):
-        return [self.FavoriteChannel(self.marionette, channel) for channel in self.marionette.find_elements(*self._favorite_list_locator)]
+        return self.FavoriteChannel.snapshot(self, *self._favorite_list_locator)
 
     class FavoriteChannel(PageRegion):
+
+        __slots__ = ()
+
         _remove_locator = ('css selector', 'div.fav-list-remove-button')
         _frequency_locator = ('css selector', 'div.fav-list-frequency')
 
+        _fields = {'frequency': (_frequency_locator, 'text')}
+
         @property
         def text(self):
-            return float(self.root_element.find_element(*self._frequency_locator).text)
+            return float(self._field('frequency'))
 
         def remove(self):
             self.root_element.find_element(*self._remove_locator).tap()
@@ -28,11 +28,12 @@ class EditPhoto(Base):
 
     @property
     def effects(self):
-        return [self.Effect(marionette=self.marionette, element=effect)
-                       for effect in self.marionette.find_elements(*self._effect_options_locator)]
+        return self.Effect.snapshot(self, *self._effect_options_locator)
 
     class Effect(PageRegion):
 
+        __slots__ = ()
+
         def tap(self):
             self.root_element.tap()
             self.wait_for_condition(lambda m: 'selected' in self.root_element.get_attribute('class'))
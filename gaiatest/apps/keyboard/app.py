@@ -3,9 +3,13 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from contextlib import contextmanager
 import time
 
 from gaiatest.apps.base import Base
+from marionette.errors import NoSuchElementException
+from marionette.errors import NoSuchFrameException
+from marionette.errors import StaleElementException
 from marionette.marionette import Actions
 
 
@@ -65,12 +69,77 @@ class Keyboard(Base):
     _upper_case_key = '20'
     _space_key = '32'
 
+    def __init__(self, marionette):
+        Base.__init__(self, marionette)
+        # layout shown after tapping a key, keyed by the layout it was tapped
+        # in and the key, or for keys that type by the class of the character
+        # and of the one typed before it, as the keyboard may change case
+        # after a letter or a full stop; learnt again for a new keyboard frame
+        self._transitions = {}
+
     # keyboard app locators
     _keyboard_frame_locator = ('css selector', '#keyboard-frame iframe')
     _keyboard_locator = ('css selector', '#keyboard')
     _button_locator = ('css selector', 'button.keyboard-key[data-keycode="%s"]')
     _highlight_key_locator = ('css selector', 'div.highlighted button')
 
+    # the keyboard frame as last found
+    _keyboard_frame = None
+
+    # reads the keycodes of the layout on screen and the state of the shift key
+    _layout_script = """
+var keys = document.querySelectorAll('button.keyboard-key');
+var shift = document.querySelector('button.keyboard-key[data-keycode="20"]');
+return [Array.map(keys, function(key) { return key.dataset.keycode; }),
+        shift ? shift.className : ''];
+"""
+
+    # characters after which the keyboard may capitalize the next letter
+    _sentence_ends = '.!?'
+
+    # milliseconds to look for a key planned from a layout seen before, which
+    # may not be the one on screen
+    _planned_key_timeout = 2000
+
+    # fast typing taps all the keys of a string from one script in the
+    # keyboard frame and checks the value of the input once at the end
+    fast_typing = False
+    # milliseconds between taps when typing fast
+    fast_tap_interval = 50
+    # seconds to hold a key for its extended characters when typing fast,
+    # just over the 700ms the keyboard waits before showing them
+    fast_long_press_wait = 0.8
+
+    # taps the keys with the given keycodes one after the other, returning
+    # true or the number of keys tapped before one not in the layout on screen
+    _tap_script = """
+var keycodes = arguments[0];
+var sendAll = arguments[1];
+var interval = arguments[2];
+var i = 0;
+function tapNext() {
+  if (i == keycodes.length) {
+    marionetteScriptFinished(true);
+    return;
+  }
+  var key = document.querySelector('button.keyboard-key[data-keycode="' + keycodes[i] + '"]');
+  if (!key) {
+    marionetteScriptFinished(i);
+    return;
+  }
+  i++;
+  SyntheticGestures.tap(key, function() { setTimeout(tapNext, interval); }, null, null, null, sendAll);
+}
+tapNext();
+"""
+
+    # returns the frame of the displayed app, from the system frame
+    _displayed_app_frame_script = """
+var windowManager = window.wrappedJSObject.WindowManager;
+var app = windowManager.getRunningApps()[windowManager.getDisplayedApp()];
+return app ? app.frame.firstChild : null;
+"""
+
     # find the key to long press and return
     def _find_key_for_longpress(self, input_value):
         for key_to_press, extended_values in self.lookup_table.iteritems():
@@ -78,25 +147,191 @@ class Keyboard(Base):
                 return key_to_press
 
     # trying to switch to right layout
-    def _switch_to_correct_layout(self, val):
+    def _switch_to_correct_layout(self, val, layout=None):
+        layout = layout or self._read_layout()
+        for i in range(2):
+            switches = self._layout_switches(val, layout)
+            if not switches:
+                break
+            layout = self._tap_planned(switches, layout)[0]
+        return layout
+
+    # this is to switch to the frame of keyboard, the frame is looked up again
+    # only once the one found before has gone
+    def _switch_to_keyboard(self):
+        self.marionette.switch_to_frame()
+        if self._keyboard_frame is not None:
+            try:
+                self.marionette.switch_to_frame(self._keyboard_frame, focus=False)
+                return
+            except (StaleElementException, NoSuchFrameException):
+                self.marionette.switch_to_frame()
+        self._keyboard_frame = self.marionette.find_element(*self._keyboard_frame_locator)
+        self.marionette.switch_to_frame(self._keyboard_frame, focus=False)
+        self._transitions = {}
+
+    # this is to select the frame of keyboard for a with block, the frame
+    # selected before it is selected again afterwards
+    @contextmanager
+    def _keyboard_selected(self):
+        if self._keyboard_frame is not None and self.marionette.current_frame is self._keyboard_frame:
+            yield
+            return
+        with self.marionette.frame():
+            self._switch_to_keyboard()
+            yield
+
+    # this is to read the layout on screen, as the set of its keycodes and
+    # the state of the shift key
+    def _read_layout(self):
+        keycodes, shift = self.marionette.execute_script(self._layout_script)
+        return frozenset(keycodes), shift
+
+    # this is to get the keycode of a key as used by the locators
+    def _keycode(self, val):
+        if len(val) == 1:
+            val = ord(val)
+        return str(val)
+
+    # this is to find the layout switches needed before typing a character
+    def _layout_switches(self, val, layout):
+        keycodes = layout[0]
+        if self._keycode(val) in keycodes:
+            return []
         # alpha is in on keyboard
         if val.isalpha():
-            if self.is_element_present(*self._key_locator(self._alpha_key)):
-                self._tap(self._alpha_key)
-            if not self.is_element_present(*self._key_locator(val)):
-                self._tap(self._upper_case_key)
+            if self._alpha_key in keycodes:
+                return [self._alpha_key]
+            return [self._upper_case_key]
         # numbers and symbols are in another keyboard
-        else:
-            if self.is_element_present(*self._key_locator(self._numeric_sign_key)):
-                self._tap(self._numeric_sign_key)
-            if not self.is_element_present(*self._key_locator(val)):
-                self._tap(self._alt_key)
-
-    # this is to switch to the frame of keyboard
-    def _switch_to_keyboard(self):
-        self.marionette.switch_to_frame()
-        keybframe = self.marionette.find_element(*self._keyboard_frame_locator)
-        self.marionette.switch_to_frame(keybframe, focus=False)
+        if self._numeric_sign_key in keycodes:
+            return [self._numeric_sign_key]
+        return [self._alt_key]
+
+    # this is to plan the taps typing a string from the layouts seen before,
+    # returning them with the characters left over where a layout is not
+    # known yet; previous is the character typed before the string
+    def _plan(self, string, layout, previous=None):
+        taps = []
+        for i, val in enumerate(string):
+            # at most two switches lead to the layout with the key
+            for j in range(2):
+                switches = self._layout_switches(val, layout)
+                if not switches:
+                    break
+                transition = (layout, self._transition_key(switches[0]))
+                if transition not in self._transitions:
+                    return taps + switches[:1], string[i:]
+                taps.append(switches[0])
+                layout = self._transitions[transition]
+            if self._keycode(val) not in layout[0]:
+                assert False, 'Key %s not found on the keyboard' % val
+            taps.append(val)
+            transition = (layout, self._transition_key(val, previous))
+            previous = val
+            if transition not in self._transitions:
+                return taps, string[i + 1:]
+            layout = self._transitions[transition]
+        return taps, ''
+
+    # this is to tell the keys switching layouts from those that type
+    def _is_switch(self, val):
+        return val in [self._alpha_key, self._numeric_sign_key, self._alt_key, self._upper_case_key]
+
+    # this is to get the class of a typed character the layout transitions
+    # are told apart by
+    def _character_class(self, val):
+        if val is None:
+            return None
+        if val.isalpha():
+            return 'letter'
+        if val.isdigit():
+            return 'digit'
+        if val == ' ':
+            return 'space'
+        if val in self._sentence_ends:
+            return 'sentence end'
+        return 'symbol'
+
+    # this is to get how a tapped key is told apart in the layout transitions
+    def _transition_key(self, val, previous=None):
+        if self._is_switch(val):
+            return val
+        return self._character_class(val), self._character_class(previous)
+
+    # this is to get the last character typed by the taps, or previous
+    def _last_typed(self, taps, previous=None):
+        for val in taps:
+            if not self._is_switch(val):
+                previous = val
+        return previous
+
+    # this is to follow the layouts the tapped keys lead to, reading the
+    # layout on screen once they are tapped to learn the transition of the
+    # last key or, if all were known, to check they still hold; transitions
+    # that did not are forgotten so they are learnt again
+    def _follow(self, taps, layout, previous=None):
+        if not taps:
+            return layout
+        transitions = []
+        for val in taps:
+            transitions.append((layout, self._transition_key(val, previous)))
+            layout = self._transitions.get(transitions[-1])
+            previous = self._last_typed([val], previous)
+        actual = self._read_layout()
+        if layout is None and None not in [transition[0] for transition in transitions]:
+            self._transitions[transitions[-1]] = actual
+        elif layout != actual:
+            for transition in transitions:
+                self._transitions.pop(transition, None)
+        return actual
+
+    # this is to tap the planned keys, only the last of them can lead to a
+    # layout not seen before; returns the layout on screen and the number of
+    # keys tapped, which is less than planned where a key is not on screen
+    # because a transition planned on did not hold
+    def _tap_planned(self, taps, layout, previous=None):
+        tapped = 0
+        self.marionette.set_search_timeout(self._planned_key_timeout)
+        try:
+            for val in taps:
+                try:
+                    key = self.marionette.find_element(*self._key_locator(val))
+                except NoSuchElementException:
+                    assert tapped, 'Key %s not found on the keyboard' % val
+                    break
+                self.marionette.tap(key)
+                tapped += 1
+                # after tap/click space key, it might get screwed up due to timing issue. adding 0.8sec for it.
+                if not self._is_switch(val) and ord(val) == int(self._space_key):
+                    time.sleep(0.8)
+        finally:
+            # set the search timeout to the default value
+            self.marionette.set_search_timeout(10000)
+        return self._follow(taps[:tapped], layout, previous), tapped
+
+    # this is to tap the planned keys from a single script, returning as
+    # _tap_planned does
+    def _tap_in_page(self, taps, layout, previous=None):
+        if not taps:
+            return layout, 0
+        send_all = self.marionette.execute_script("return typeof window.wrappedJSObject.MouseEventShim === 'undefined';")
+        result = self.marionette.execute_async_script(
+            self._tap_script, [[self._keycode(val) for val in taps], send_all, self.fast_tap_interval])
+        tapped = result is True and len(taps) or result
+        assert tapped, 'Key %s not found on the keyboard' % taps[0]
+        return self._follow(taps[:tapped], layout, previous), tapped
+
+    # this is to read the value of the input focused in the displayed app,
+    # or None if it has none
+    def _focused_value(self):
+        with self.marionette.frame():
+            app_frame = self.marionette.execute_script(self._displayed_app_frame_script)
+            if not app_frame:
+                return None
+            self.marionette.switch_to_frame(app_frame, focus=False)
+            return self.marionette.execute_script(
+                "var input = document.activeElement; return input && 'value' in input ? input.value : null;")
 
     # this is to get the locator of desired key on keyboard
     def _key_locator(self, val):
@@ -113,34 +348,31 @@ class Keyboard(Base):
     # This is for selecting special characters after long pressing
     # "selection" is the nth special element you want to select (n>=1)
     def choose_extended_character(self, long_press_key, selection, movement=True):
-        self._switch_to_keyboard()
-        action = Actions(self.marionette)
-
-        # after switching to correct keyboard, set long press if the key is there
-        self._switch_to_correct_layout(long_press_key)
-        key = self._key_locator(long_press_key)
-        if self.is_element_present(*key):
-            keyobj = self.marionette.find_element(*key)
-            action.press(keyobj).wait(2).perform()
-        else:
-            assert False, 'Key %s not found on the keyboard' % long_press_key
-
-        # find the extended key and perform the action chain
-        extend_keys = self.marionette.find_elements(*self._highlight_key_locator)
-        if movement is True:
-            action.move(extend_keys[selection - 1]).perform()
-        action.release().perform()
-        time.sleep(1)
+        with self._keyboard_selected():
+            action = Actions(self.marionette)
 
-        self.marionette.switch_to_frame()
+            # after switching to correct keyboard, set long press if the key is there
+            self._switch_to_correct_layout(long_press_key)
+            key = self._key_locator(long_press_key)
+            if self.is_element_present(*key):
+                keyobj = self.marionette.find_element(*key)
+                action.press(keyobj).wait(2).perform()
+            else:
+                assert False, 'Key %s not found on the keyboard' % long_press_key
+
+            # find the extended key and perform the action chain
+            extend_keys = self.marionette.find_elements(*self._highlight_key_locator)
+            if movement is True:
+                action.move(extend_keys[selection - 1]).perform()
+            action.release().perform()
+            time.sleep(1)
 
     def enable_caps_lock(self):
-        self._switch_to_keyboard()
-        if self.is_element_present(*self._key_locator(self._alpha_key)):
-            self._tap(self._alpha_key)
-        key_obj = self.marionette.find_element(*self._key_locator(self._upper_case_key))
-        self.marionette.double_tap(key_obj)
-        self.marionette.switch_to_frame()
+        with self._keyboard_selected():
+            if self.is_element_present(*self._key_locator(self._alpha_key)):
+                self._tap(self._alpha_key)
+            key_obj = self.marionette.find_element(*self._key_locator(self._upper_case_key))
+            self.marionette.double_tap(key_obj)
 
     # this is to detect if the element is present in a shorter time
     # default timeout to 600 and allow people to set a higher timeout
@@ -158,41 +390,60 @@ class Keyboard(Base):
     # do a long press on a character
     def long_press(self, key, timeout=2000):
         if len(key) == 1:
-            self._switch_to_keyboard()
-            key_obj = self.marionette.find_element(*self._key_locator(key))
-            action = Actions(self.marionette)
-            action.press(key_obj).wait(timeout / 1000).release().perform()
-            self.marionette.switch_to_frame()
-
-    # this would go through fastest way to tap/click through a string
-    def send(self, string):
-        self._switch_to_keyboard()
-        for val in string:
-            if ord(val) > 127:
-                # this would get the right key to long press and switch to the right keyboard
-                middle_key_val = self._find_key_for_longpress(val.encode('UTF-8'))
-                self._switch_to_correct_layout(middle_key_val)
-
-                # find the key to long press and press it to get the extended characters list
-                middle_key = self.marionette.find_element(*self._key_locator(middle_key_val))
+            with self._keyboard_selected():
+                key_obj = self.marionette.find_element(*self._key_locator(key))
                 action = Actions(self.marionette)
-                action.press(middle_key).wait(2).perform()
+                action.press(key_obj).wait(timeout / 1000).release().perform()
 
-                # find the targeted extended key to send
-                target_key = self.marionette.find_element(*self._key_locator(val))
-                action.move(target_key).release().perform()
-            else:
-                # after switching to correct keyboard, tap/click if the key is there
-                self._switch_to_correct_layout(val)
-                if self.is_element_present(*self._key_locator(val)):
-                    self._tap(val)
+    # this would go through fastest way to tap/click through a string
+    # the layouts met while typing are remembered, so once they are all known
+    # the switches and taps for the whole string are planned without probing,
+    # and the layout is read once after each planned run to check the plan
+    # with fast set the taps are made from a single script per planned run of
+    # keys, and the value of the input is checked once at the end
+    def send(self, string, fast=None):
+        fast = self.fast_typing if fast is None else fast
+        text = string
+        if fast:
+            expected = self._focused_value()
+        with self._keyboard_selected():
+            layout = self._read_layout()
+            previous = None
+            while string:
+                val = string[0]
+                if ord(val) > 127:
+                    # this would get the right key to long press and switch to the right keyboard
+                    middle_key_val = self._find_key_for_longpress(val.encode('UTF-8'))
+                    self._switch_to_correct_layout(middle_key_val, layout)
+
+                    # find the key to long press and press it to get the extended characters list
+                    middle_key = self.marionette.find_element(*self._key_locator(middle_key_val))
+                    action = Actions(self.marionette)
+                    action.press(middle_key).wait(fast and self.fast_long_press_wait or 2).perform()
+
+                    # find the targeted extended key to send
+                    target_key = self.marionette.find_element(*self._key_locator(val))
+                    action.move(target_key).release().perform()
+                    layout = self._read_layout()
+                    previous = val
+                    string = string[1:]
                 else:
-                    assert False, 'Key %s not found on the keyboard' % val
-
-            # after tap/click space key, it might get screwed up due to timing issue. adding 0.8sec for it.
-            if ord(val) == int(self._space_key):
-                time.sleep(0.8)
-        self.marionette.switch_to_frame()
+                    end = len(string)
+                    for i, char in enumerate(string):
+                        if ord(char) > 127:
+                            end = i
+                            break
+                    taps, rest = self._plan(string[:end], layout, previous)
+                    layout, tapped = (fast and self._tap_in_page or self._tap_planned)(taps, layout, previous)
+                    previous = self._last_typed(taps[:tapped], previous)
+                    # the characters of keys not tapped are planned again
+                    # from the layout on screen
+                    untyped = ''.join(val for val in taps[tapped:] if not self._is_switch(val))
+                    string = untyped + rest + string[end:]
+
+        if fast and expected is not None:
+            value = self._focused_value()
+            assert value == expected + text, 'Typed %r but the input holds %r' % (text, value)
 
     # Switch keyboard language
     # Mapping of language code => {
@@ -216,53 +467,45 @@ class Keyboard(Base):
     def switch_keyboard_language(self, lang_code):
         keyboard_language_locator = ("css selector", ".keyboard-row button[data-keyboard='%s']" % lang_code)
 
-        self._switch_to_keyboard()
-        language_key = self.marionette.find_element(*self._language_key_locator)
-        action = Actions(self.marionette)
-        action.press(language_key).wait(2).perform()
-        target_kb_layout = self.marionette.find_element(*keyboard_language_locator)
-        action.move(target_kb_layout).release().perform()
-        self.marionette.switch_to_frame()
+        with self._keyboard_selected():
+            language_key = self.marionette.find_element(*self._language_key_locator)
+            action = Actions(self.marionette)
+            action.press(language_key).wait(2).perform()
+            target_kb_layout = self.marionette.find_element(*keyboard_language_locator)
+            action.move(target_kb_layout).release().perform()
 
     # switch to keyboard with numbers and special characters
     def switch_to_number_keyboard(self):
-        self._switch_to_keyboard()
-        self._tap(self._numeric_sign_key)
-        self.marionette.switch_to_frame()
+        with self._keyboard_selected():
+            self._tap(self._numeric_sign_key)
 
     # switch to keyboard with alphabetic keys
     def switch_to_alpha_keyboard(self):
-        self._switch_to_keyboard()
-        self._tap(self._alpha_key)
-        self.marionette.switch_to_frame()
+        with self._keyboard_selected():
+            self._tap(self._alpha_key)
 
     # following are "5 functions" to substitute finish switch_to_frame()s and tap() for you
     def tap_shift(self):
-        self._switch_to_keyboard()
-        if self.is_element_present(*self._key_locator(self._alpha_key)):
-            self._tap(self._alpha_key)
-        self._tap(self._upper_case_key)
-        self.marionette.switch_to_frame()
+        with self._keyboard_selected():
+            if self.is_element_present(*self._key_locator(self._alpha_key)):
+                self._tap(self._alpha_key)
+            self._tap(self._upper_case_key)
 
     def tap_backspace(self):
-        self._switch_to_keyboard()
-        bs = self.marionette.find_element(self._button_locator[0], self._button_locator[1] % self._backspace_key)
-        self.marionette.tap(bs)
-        self.marionette.switch_to_frame()
+        with self._keyboard_selected():
+            bs = self.marionette.find_element(self._button_locator[0], self._button_locator[1] % self._backspace_key)
+            self.marionette.tap(bs)
 
     def tap_space(self):
-        self._switch_to_keyboard()
-        self._tap(self._space_key)
-        self.marionette.switch_to_frame()
+        with self._keyboard_selected():
+            self._tap(self._space_key)
 
     def tap_enter(self):
-        self._switch_to_keyboard()
-        self._tap(self._enter_key)
-        self.marionette.switch_to_frame()
+        with self._keyboard_selected():
+            self._tap(self._enter_key)
 
     def tap_alt(self):
-        self._switch_to_keyboard()
-        if self.is_element_present(*self._key_locator(self._numeric_sign_key)):
-            self._tap(self._numeric_sign_key)
-        self._tap(self._alt_key)
-        self.marionette.switch_to_frame()
+        with self._keyboard_selected():
+            if self.is_element_present(*self._key_locator(self._numeric_sign_key)):
+                self._tap(self._numeric_sign_key)
+            self._tap(self._alt_key)
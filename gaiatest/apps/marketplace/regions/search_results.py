@@ -23,27 +23,33 @@ class SearchResults(Base):
 
     @property
     def search_results(self):
-        return [self.Result(marionette=self.marionette, element=result)
-                for result in self.marionette.find_elements(*self._search_result_locator)]
+        return self.Result.snapshot(self, *self._search_result_locator)
 
     class Result(PageRegion):
 
+        __slots__ = ()
+
         _name_locator = ('css selector', '.info > h3')
         _author_locator = ('css selector', '.info .author')
         _install_button_locator = ('css selector', '.button.product.install')
         _price_locator = ('css selector', '.premium.button.product')
 
+        _fields = {'name': (_name_locator, 'text'),
+                   'author': (_author_locator, 'text'),
+                   'install_button_text': (_install_button_locator, 'text'),
+                   'price': (_price_locator, 'text')}
+
         @property
         def name(self):
-            return self.root_element.find_element(*self._name_locator).text
+            return self._field('name')
 
         @property
         def author(self):
-            return self.root_element.find_element(*self._author_locator).text
+            return self._field('author')
 
         @property
         def install_button_text(self):
-            return self.root_element.find_element(*self._install_button_locator).text
+            return self._field('install_button_text')
 
         def tap_install_button(self):
             self.marionette.tap(self.root_element.find_element(*self._install_button_locator))
@@ -51,7 +57,7 @@ class SearchResults(Base):
 
         @property
         def price(self):
-            return self.root_element.find_element(*self._price_locator).text
+            return self._field('price')
 
 
 class FilterResults(Base):
@@ -182,7 +182,9 @@ var GaiaApps = {
 
   // Launches app with the specified name (e.g., 'Calculator'); returns the
   // app frame's id if successful, false if the app can't be found, or times
-  // out if the app frame can't be found after launching the app.
+  // out if the app frame can't be found after launching the app. When the app
+  // had to be launched the result also holds the detail of the apploadtime
+  // event and the milliseconds from launching to the response.
   launchWithName: function(name) {
     GaiaApps.locateWithName(name, function(app, appName, entryPoint) {
       if (app) {
@@ -190,12 +192,17 @@ var GaiaApps = {
         let runningApps = windowManager.getRunningApps();
         let origin = GaiaApps.getRunningAppOrigin(appName);
 
+        let launchStart = null;
+        let loadTime = null;
+
         let sendResponse = function() {
           let app = runningApps[origin];
           let result = {frame: app.frame.firstChild,
             src: app.iframe.src,
             name: app.name,
-            origin: origin};
+            origin: origin,
+            loadTime: loadTime,
+            launchTime: launchStart && Date.now() - launchStart};
           marionetteScriptFinished(result);
         };
 
@@ -204,8 +211,9 @@ var GaiaApps = {
           sendResponse();
         }
         else {
-          window.addEventListener('apploadtime', function apploadtime() {
+          window.addEventListener('apploadtime', function apploadtime(aEvent) {
             window.removeEventListener('apploadtime', apploadtime);
+            loadTime = (aEvent.wrappedJSObject || aEvent).detail || null;
             waitFor(
               function() {
                 console.log("app with origin '" + origin + "' has launched");
@@ -218,6 +226,7 @@ var GaiaApps = {
             );
           });
           console.log("launching app with name '" + appName + "'");
+          launchStart = Date.now();
           app.launch(entryPoint || null);
         }
       } else {
@@ -226,6 +235,29 @@ var GaiaApps = {
     });
   },
 
+  // Returns the names of the installed apps that can be launched, one for
+  // each entry point, leaving out the system apps.
+  getInstalledAppNames: function() {
+    let appsReq = navigator.mozApps.mgmt.getAll();
+    appsReq.onsuccess = function() {
+      let names = [];
+      appsReq.result.forEach(function(app) {
+        let manifest = app.manifest;
+        if (manifest.role) {
+          return;
+        }
+        if (manifest.entry_points) {
+          for (let ep in manifest.entry_points) {
+            names.push(manifest.entry_points[ep].name);
+          }
+        } else {
+          names.push(manifest.name);
+        }
+      });
+      marionetteScriptFinished(names);
+    };
+  },
+
   /**
    * Uninstalls the app with the specified name.
    */
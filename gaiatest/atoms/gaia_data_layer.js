@@ -95,6 +95,67 @@ var GaiaDataLayer = {
     };
   },
 
+  // Runs aTask(item, callback) for every item keeping at most aConcurrency
+  // tasks in flight, then calls aCallback with the result of each task in
+  // order. Progress is logged every aProgressStep completed tasks.
+  runInWindows: function(aItems, aConcurrency, aTask, aCallback, aProgressStep) {
+    var concurrency = aConcurrency || 10;
+    var progressStep = aProgressStep || 100;
+    var total = aItems.length;
+    var results = new Array(total);
+    var next = 0;
+    var done = 0;
+
+    function runNext() {
+      var index = next++;
+      aTask(aItems[index], function(aResult) {
+        results[index] = aResult;
+        if (++done === total) {
+          aCallback(results);
+        }
+        else {
+          if (done % progressStep === 0) {
+            console.log('completed ' + done + ' of ' + total);
+          }
+          if (next < total) {
+            runNext();
+          }
+        }
+      });
+    }
+
+    if (total === 0) {
+      aCallback(results);
+      return;
+    }
+
+    for (var i = 0; i < Math.min(concurrency, total); i++) {
+      runNext();
+    }
+  },
+
+  // Saves the given contacts keeping at most aConcurrency save requests in
+  // flight; returns an array with the success of each contact in order.
+  insertContacts: function(aContacts, aConcurrency) {
+    SpecialPowers.addPermission('contacts-create', true, document);
+    this.runInWindows(aContacts, aConcurrency, function(aContact, aCallback) {
+      var contact = new mozContact();
+      contact.init(aContact);
+      var req = window.navigator.mozContacts.save(contact);
+      req.onsuccess = function () {
+        aCallback(true);
+      };
+      req.onerror = function () {
+        console.error('error saving contact', req.error.name);
+        aCallback(false);
+      };
+    }, function(aResults) {
+      console.log('saved ' + aResults.length + ' contacts');
+      SpecialPowers.removePermission('contacts-create', document);
+      marionetteScriptFinished(aResults);
+    });
+  },
+
   getAllContacts: function(aCallback) {
     var callback = aCallback || marionetteScriptFinished;
     SpecialPowers.addPermission('contacts-read', true, document);
@@ -111,6 +172,28 @@ var GaiaDataLayer = {
     };
   },
 
+  getContactCount: function(aCallback) {
+    var callback = aCallback || marionetteScriptFinished;
+    var contacts = window.navigator.mozContacts;
+    if (!contacts.getCount) {
+      this.getAllContacts(function(aContacts) {
+        callback(aContacts.length);
+      });
+      return;
+    }
+    SpecialPowers.addPermission('contacts-read', true, document);
+    var req = contacts.getCount();
+    req.onsuccess = function () {
+      SpecialPowers.removePermission('contacts-read', document);
+      callback(req.result);
+    };
+    req.onerror = function () {
+      console.error('error counting contacts', req.error.name);
+      SpecialPowers.removePermission('contacts-read', document);
+      callback(0);
+    };
+  },
+
   getSIMContacts: function(aCallback) {
     var callback = aCallback || marionetteScriptFinished;
     SpecialPowers.addPermission('contacts-read', true, document);
@@ -127,24 +210,33 @@ var GaiaDataLayer = {
     };
   },
 
-  removeAllContacts: function() {
+  removeAllContacts: function(aConcurrency) {
     var self = this;
+    var contacts = window.navigator.mozContacts;
+
+    if (contacts.clear) {
+      SpecialPowers.addPermission('contacts-write', true, document);
+      var req = contacts.clear();
+      req.onsuccess = function() {
+        console.log('success clearing contacts');
+        SpecialPowers.removePermission('contacts-write', document);
+        marionetteScriptFinished(true);
+      };
+      req.onerror = function() {
+        console.error('error clearing contacts', req.error.name);
+        SpecialPowers.removePermission('contacts-write', document);
+        marionetteScriptFinished(false);
+      };
+      return;
+    }
+
     this.getAllContacts(function (aContacts) {
-      if (aContacts.length > 0) {
-        var contactsLength = aContacts.length;
-        var done = 0;
-        for (var i = 0; i < contactsLength; i++) {
-          self.removeContact(aContacts[i], function () {
-            if (++done === contactsLength) {
-              marionetteScriptFinished(true);
-            }
-          });
-        }
-      }
-      else {
-        console.log('no contacts to remove');
-          marionetteScriptFinished(true);
-      }
+      console.log('removing ' + aContacts.length + ' contacts');
+      self.runInWindows(aContacts, aConcurrency, function(aContact, aCallback) {
+        self.removeContact(aContact, aCallback);
+      }, function(aResults) {
+        marionetteScriptFinished(aResults.indexOf(false) === -1);
+      });
     });
   },
 
@@ -159,7 +251,7 @@ var GaiaDataLayer = {
       callback(true);
     };
     req.onerror = function() {
-      console.error("error removing contact with id '" + aContacts[i].id + "'");
+      console.error("error removing contact with id '" + aContact.id + "'");
       SpecialPowers.removePermission('contacts-write', document);
       callback(false);
     };
@@ -198,6 +290,23 @@ var GaiaDataLayer = {
     }
   },
 
+  setSettings: function(aSettings, aReturnOnSuccess) {
+    SpecialPowers.addPermission('settings-readwrite', true, document);
+    var returnOnSuccess = aReturnOnSuccess || aReturnOnSuccess === undefined;
+    console.log('setting ' + Object.keys(aSettings).join(', '));
+    var req = window.navigator.mozSettings.createLock().set(aSettings);
+    req.onsuccess = function() {
+      console.log('settings changed');
+      if (returnOnSuccess) {
+        marionetteScriptFinished(true);
+      }
+    };
+    req.onerror = function() {
+      console.log('error changing settings', req.error.name);
+      marionetteScriptFinished(false);
+    }
+  },
+
   connectToWiFi: function(aNetwork, aCallback) {
     var callback = aCallback || marionetteScriptFinished;
     var manager = window.navigator.mozWifiManager;
@@ -421,7 +530,7 @@ var GaiaDataLayer = {
     );
   },
 
-  deleteAllSms: function(aCallback) {
+  deleteAllSms: function(aCallback, aConcurrency) {
     var callback = aCallback || marionetteScriptFinished;
     console.log('searching for sms messages');
 
@@ -460,34 +569,27 @@ var GaiaDataLayer = {
     };
 
     function deleteSmsMsgs(msgList) {
-      let smsId = msgList.shift();
-      console.log("deleting sms id: " + smsId);
-      let request = sms.delete(smsId);
-
-      request.onsuccess = function(event) {
-        if (event.target.result) {
-          // Message deleted, continue until none are left
-          if (msgList.length) {
-            deleteSmsMsgs(msgList);
-          } else {
-            // All messages deleted
-            console.log('finished deleting all sms messages');
-            disableSms();
-            callback(true);
-          }
-        } else {
-          console.log("sms delete failed");
-          disableSms();
-          callback(false);
-        }
-      };
+      GaiaDataLayer.runInWindows(msgList, aConcurrency, function(aSmsId, aCallback) {
+        console.log("deleting sms id: " + aSmsId);
+        let request = sms.delete(aSmsId);
 
-      request.onerror = function(event) {
-        console.log("sms.delete request returned unexpected error: "
-            + event.target.error.name );
+        request.onsuccess = function(event) {
+          if (!event.target.result) {
+            console.log("sms delete failed");
+          }
+          aCallback(!!event.target.result);
+        };
+
+        request.onerror = function(event) {
+          console.log("sms.delete request returned unexpected error: "
+              + event.target.error.name );
+          aCallback(false);
+        };
+      }, function(aResults) {
+        console.log('finished deleting all sms messages');
         disableSms();
-        callback(false);
-      };
+        callback(aResults.indexOf(false) === -1);
+      });
     }
 
     function disableSms() {
@@ -3,12 +3,18 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import base64
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
 import json
 import os
 import sys
+import tempfile
+import threading
 import time
 import traceback
 
+from marionette import HTMLElement
 from marionette import MarionetteTestCase
 from marionette import Marionette
 from marionette import MarionetteTouchMixin
@@ -19,12 +25,283 @@ from marionette.errors import StaleElementException
 import mozdevice
 
 
+class Wait(object):
+    """Polls a condition until it returns a truthy value or the timeout expires.
+
+    The condition is probed immediately and then at the intervals given in
+    `intervals`, repeating the last one until the timeout. Both `timeout` and
+    `intervals` can be changed globally on the class or overridden per call.
+
+    When `in_page` is set, element waits are instead run inside the current
+    frame as a single async script which watches the DOM with a
+    MutationObserver, so a wait costs one round trip rather than one per probe.
+    Displayed there means the element and its ancestors are not hidden by
+    display, visibility or opacity and it has a size, which is close to but
+    not the same as the is_displayed check of Marionette.
+    """
+
+    # default timeout in seconds
+    timeout = 30
+
+    # polling schedule in seconds, the last interval is used as the cap
+    intervals = (0.01, 0.025, 0.05, 0.1, 0.25)
+
+    # run element waits in the page instead of polling from the client
+    in_page = False
+
+    # longest time in seconds a single in-page wait script may run, this has
+    # to stay below the script timeout set on the session
+    in_page_slice = 20
+
+    _in_page_strategies = ['id', 'name', 'class name', 'tag name', 'css selector',
+                           'link text', 'partial link text', 'xpath']
+
+    _in_page_script = """
+var by = arguments[0], value = arguments[1], condition = arguments[2];
+var timeout = arguments[3];
+
+function quote(aValue) {
+  return '"' + aValue.replace(/["\\\\]/g, '\\\\$&') + '"';
+}
+
+function find() {
+  switch (by) {
+    case 'id':
+      return document.getElementById(value);
+    case 'name':
+      return document.querySelector('[name=' + quote(value) + ']');
+    case 'class name':
+      return document.getElementsByClassName(value)[0] || null;
+    case 'tag name':
+      return document.getElementsByTagName(value)[0] || null;
+    case 'css selector':
+      return document.querySelector(value);
+    case 'link text':
+    case 'partial link text':
+      var links = document.getElementsByTagName('a');
+      for (var i = 0; i < links.length; i++) {
+        var text = links[i].textContent.trim();
+        if (by === 'link text' ? text === value : text.indexOf(value) !== -1) {
+          return links[i];
+        }
+      }
+      return null;
+    case 'xpath':
+      return document.evaluate(value, document, null,
+        XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+  }
+}
+
+function isDisplayed(element) {
+  for (var node = element; node && node.nodeType === 1; node = node.parentNode) {
+    var style = window.getComputedStyle(node);
+    if (style.display === 'none' || style.visibility === 'hidden' ||
+        style.opacity === '0') {
+      return false;
+    }
+  }
+  var rect = element.getBoundingClientRect();
+  return rect.width > 0 && rect.height > 0;
+}
+
+function check() {
+  var element = find();
+  switch (condition) {
+    case 'present':
+      return !!element;
+    case 'not present':
+      return !element;
+    case 'displayed':
+      return !!element && isDisplayed(element);
+    case 'not displayed':
+      return !element || !isDisplayed(element);
+  }
+}
+
+var observer, timer, frame, finished = false;
+
+function done(aResult) {
+  if (finished) {
+    return;
+  }
+  finished = true;
+  observer.disconnect();
+  clearTimeout(timer);
+  window.cancelAnimationFrame(frame);
+  marionetteScriptFinished(aResult);
+}
+
+// style changes from transitions do not mutate the DOM, so check on every
+// animation frame as well
+function onFrame() {
+  if (check()) {
+    done(true);
+  } else {
+    frame = window.requestAnimationFrame(onFrame);
+  }
+}
+
+if (check()) {
+  marionetteScriptFinished(true);
+} else {
+  observer = new MutationObserver(function() {
+    if (check()) {
+      done(true);
+    }
+  });
+  observer.observe(document, {attributes: true, childList: true,
+                              characterData: true, subtree: true});
+  timer = setTimeout(function() { done(false); }, timeout);
+  frame = window.requestAnimationFrame(onFrame);
+}
+"""
+
+    def __init__(self, marionette, timeout=None, interval=None,
+                 ignored_exceptions=(NoSuchElementException, StaleElementException),
+                 in_page=None):
+        self.marionette = marionette
+        self.timeout = float(self.timeout if timeout is None else timeout)
+        if interval is not None:
+            self.intervals = (interval,)
+        self.ignored_exceptions = ignored_exceptions
+        if in_page is not None:
+            self.in_page = in_page
+
+    def _schedule(self):
+        for interval in self.intervals:
+            yield interval
+        while True:
+            yield self.intervals[-1]
+
+    def until(self, condition, message='Condition timed out'):
+        end_time = time.time() + self.timeout
+        for interval in self._schedule():
+            try:
+                value = condition(self.marionette)
+                if value:
+                    return value
+            except self.ignored_exceptions:
+                pass
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                raise TimeoutException(message)
+            time.sleep(min(interval, remaining))
+
+    def _until_in_page(self, by, locator, condition, message):
+        end_time = time.time() + self.timeout
+        while True:
+            remaining = end_time - time.time()
+            slice_ms = int(max(0, min(remaining, self.in_page_slice)) * 1000)
+            if self.marionette.execute_async_script(
+                    self._in_page_script, script_args=[by, locator, condition, slice_ms]):
+                return
+            if time.time() >= end_time:
+                raise TimeoutException(message)
+
+    def _use_in_page(self, by):
+        return self.in_page and by in self._in_page_strategies
+
+    def for_element_present(self, by, locator):
+        if self._use_in_page(by):
+            self._until_in_page(by, locator, 'present', 'Element %s not found before timeout' % locator)
+            return self.marionette.find_element(by, locator)
+        return self.until(
+            lambda m: m.find_element(by, locator),
+            'Element %s not found before timeout' % locator)
+
+    def for_element_not_present(self, by, locator):
+        if self._use_in_page(by):
+            return self._until_in_page(by, locator, 'not present', 'Element %s still present after timeout' % locator)
+
+        def not_present(m):
+            try:
+                m.find_element(by, locator)
+                return False
+            except NoSuchElementException:
+                return True
+        self.until(not_present, 'Element %s still present after timeout' % locator)
+
+    def for_element_displayed(self, by, locator):
+        if self._use_in_page(by):
+            return self._until_in_page(by, locator, 'displayed', 'Element %s not visible before timeout' % locator)
+        self.until(
+            lambda m: m.find_element(by, locator).is_displayed(),
+            'Element %s not visible before timeout' % locator)
+
+    def for_element_not_displayed(self, by, locator):
+        if self._use_in_page(by):
+            return self._until_in_page(by, locator, 'not displayed', 'Element %s still visible after timeout' % locator)
+
+        def not_displayed(m):
+            try:
+                return not m.find_element(by, locator).is_displayed()
+            except NoSuchElementException:
+                return True
+        self.until(not_displayed, 'Element %s still visible after timeout' % locator)
+
+
+@contextmanager
+def _already_selected():
+    yield
+
+
+def in_top_frame(marionette):
+    """Selects the top frame for a with block. Where the client keeps track of
+    its frames, the frame selected before is selected again afterwards, so the
+    GaiaApps and GaiaData helpers using it leave their caller in its own frame
+    rather than in the top frame. A plain client is left in the top frame."""
+    if isinstance(marionette, FrameTracker):
+        return marionette.frame()
+    marionette.switch_to_frame()
+    return _already_selected()
+
+
+class Atoms(object):
+    """Imports the JS atoms into a Marionette session.
+
+    Each atom file is hashed once per process and imported at most once per
+    session; importing an atom the session already has is a no-op. Marionette
+    keeps imported scripts for the whole session, so they are available in
+    every frame without importing them again after a switch.
+    """
+
+    # content hash of each atom file, keyed by path
+    _hashes = {}
+
+    # (session, hashes of the imported atoms) keyed by Marionette instance
+    _imported = {}
+
+    @classmethod
+    def path(cls, name):
+        return os.path.abspath(os.path.join(__file__, os.path.pardir, 'atoms', name))
+
+    @classmethod
+    def import_script(cls, marionette, name):
+        js = cls.path(name)
+        if js not in cls._hashes:
+            with open(js, 'rb') as f:
+                cls._hashes[js] = hashlib.sha1(f.read()).hexdigest()
+
+        session = repr(marionette.session)
+        imported_session, imported = cls._imported.get(id(marionette), (None, set()))
+        if imported_session != session:
+            imported = set()
+            cls._imported[id(marionette)] = (session, imported)
+
+        if cls._hashes[js] not in imported:
+            marionette.import_script(js)
+            imported.add(cls._hashes[js])
+
+    @classmethod
+    def forget(cls, marionette):
+        cls._imported.pop(id(marionette), None)
+
+
 class LockScreen(object):
 
     def __init__(self, marionette):
         self.marionette = marionette
-        js = os.path.abspath(os.path.join(__file__, os.path.pardir, 'atoms', "gaia_lock_screen.js"))
-        self.marionette.import_script(js)
+        Atoms.import_script(self.marionette, 'gaia_lock_screen.js')
 
     @property
     def is_locked(self):
@@ -44,23 +321,39 @@ class LockScreen(object):
 
 class GaiaApp(object):
 
-    def __init__(self, origin=None, name=None, frame=None, src=None):
+    __slots__ = ('frame', 'src', 'name', 'origin', 'load_time', 'launch_time')
+
+    def __init__(self, origin=None, name=None, frame=None, src=None, load_time=None, launch_time=None):
         self.frame = frame
-        self.frame_id = frame
         self.src = src
         self.name = name
         self.origin = origin
+        # detail of the apploadtime event and milliseconds taken to launch,
+        # only known when the app was not already displayed
+        self.load_time = load_time
+        self.launch_time = launch_time
+
+    @property
+    def frame_id(self):
+        return self.frame
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, GaiaApp):
+            return NotImplemented
+        return (self.origin, self.name, self.frame, self.src) == (other.origin, other.name, other.frame, other.src)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
 
 
 class GaiaApps(object):
 
     def __init__(self, marionette):
         self.marionette = marionette
-        js = os.path.abspath(os.path.join(__file__, os.path.pardir, 'atoms', "gaia_apps.js"))
-        self.marionette.import_script(js)
+        Atoms.import_script(self.marionette, 'gaia_apps.js')
 
     def get_permission(self, app_name, permission_name):
         return self.marionette.execute_async_script("return GaiaApps.getPermission('%s', '%s')" % (app_name, permission_name))
@@ -76,16 +369,23 @@ class GaiaApps(object):
         app = GaiaApp(frame=result.get('frame'),
                       src=result.get('src'),
                       name=result.get('name'),
-                      origin=result.get('origin'))
+                      origin=result.get('origin'),
+                      load_time=result.get('loadTime'),
+                      launch_time=result.get('launchTime'))
         if app.frame_id is None:
             raise Exception("App failed to launch; there is no app frame")
         if switch_to_frame:
             self.switch_to_frame(app.frame_id, url)
         return app
 
+    @property
+    def installed_app_names(self):
+        with in_top_frame(self.marionette):
+            return self.marionette.execute_async_script("GaiaApps.getInstalledAppNames()")
+
     def is_app_installed(self, app_name):
-        self.marionette.switch_to_frame()
-        return self.marionette.execute_async_script("GaiaApps.locateWithName('%s')" % app_name)
+        with in_top_frame(self.marionette):
+            return self.marionette.execute_async_script("GaiaApps.locateWithName('%s')" % app_name)
 
     def uninstall(self, name):
         self.marionette.switch_to_frame()
@@ -93,15 +393,11 @@ class GaiaApps(object):
 
     def kill(self, app):
         self.marionette.switch_to_frame()
-        js = os.path.abspath(os.path.join(__file__, os.path.pardir, 'atoms', "gaia_apps.js"))
-        self.marionette.import_script(js)
         result = self.marionette.execute_async_script("GaiaApps.kill('%s');" % app.origin)
         assert result, "Failed to kill app with name '%s'" % app.name
 
     def kill_all(self):
         self.marionette.switch_to_frame()
-        js = os.path.abspath(os.path.join(__file__, os.path.pardir, 'atoms', "gaia_apps.js"))
-        self.marionette.import_script(js)
         self.marionette.execute_async_script("GaiaApps.killAll()")
 
     def runningApps(self):
@@ -128,8 +424,7 @@ class GaiaData(object):
     def __init__(self, marionette, testvars=None):
         self.marionette = marionette
         self.testvars = testvars or {}
-        js = os.path.abspath(os.path.join(__file__, os.path.pardir, 'atoms', "gaia_data_layer.js"))
-        self.marionette.import_script(js)
+        Atoms.import_script(self.marionette, 'gaia_data_layer.js')
         self.marionette.set_search_timeout(10000)
 
     def set_time(self, date_number):
@@ -139,25 +434,43 @@ class GaiaData(object):
 
     @property
     def all_contacts(self):
-        self.marionette.switch_to_frame()
-        return self.marionette.execute_async_script('return GaiaDataLayer.getAllContacts();', special_powers=True)
+        with in_top_frame(self.marionette):
+            return self.marionette.execute_async_script('return GaiaDataLayer.getAllContacts();', special_powers=True)
+
+    @property
+    def contacts_count(self):
+        with in_top_frame(self.marionette):
+            return self.marionette.execute_async_script('return GaiaDataLayer.getContactCount();', special_powers=True)
 
     @property
     def sim_contacts(self):
-        self.marionette.switch_to_frame()
-        return self.marionette.execute_async_script('return GaiaDataLayer.getSIMContacts();', special_powers=True)
+        with in_top_frame(self.marionette):
+            return self.marionette.execute_async_script('return GaiaDataLayer.getSIMContacts();', special_powers=True)
 
     def insert_contact(self, contact):
-        self.marionette.switch_to_frame()
-        result = self.marionette.execute_async_script('return GaiaDataLayer.insertContact(%s);' % json.dumps(contact), special_powers=True)
-        assert result, 'Unable to insert contact %s' % contact
-
-    def remove_all_contacts(self, default_script_timeout=60000):
-        self.marionette.switch_to_frame()
-        self.marionette.set_script_timeout(max(default_script_timeout, 1000 * len(self.all_contacts)))
-        result = self.marionette.execute_async_script('return GaiaDataLayer.removeAllContacts();', special_powers=True)
-        assert result, 'Unable to remove all contacts'
-        self.marionette.set_script_timeout(default_script_timeout)
+        with in_top_frame(self.marionette):
+            result = self.marionette.execute_async_script('return GaiaDataLayer.insertContact(%s);' % json.dumps(contact), special_powers=True)
+            assert result, 'Unable to insert contact %s' % contact
+
+    def insert_contacts(self, contacts, concurrency=10, default_script_timeout=60000):
+        with in_top_frame(self.marionette):
+            self.marionette.set_script_timeout(max(default_script_timeout, 100 * len(contacts)))
+            results = self.marionette.execute_async_script(
+                'return GaiaDataLayer.insertContacts(%s, %d);' % (json.dumps(contacts), concurrency), special_powers=True)
+            self.marionette.set_script_timeout(default_script_timeout)
+            failed = [contact for contact, result in zip(contacts, results) if not result]
+            assert not failed, 'Unable to insert contacts %s' % failed
+            return results
+
+    def remove_all_contacts(self, default_script_timeout=60000, concurrency=10):
+        # without mozContacts.clear the contacts are removed in windows of
+        # concurrency at a time, allow a second for each window
+        with in_top_frame(self.marionette):
+            windows = -(-self.contacts_count // concurrency)
+            self.marionette.set_script_timeout(max(default_script_timeout, 1000 * windows))
+            result = self.marionette.execute_async_script('return GaiaDataLayer.removeAllContacts(%d);' % concurrency, special_powers=True)
+            assert result, 'Unable to remove all contacts'
+            self.marionette.set_script_timeout(default_script_timeout)
 
     def get_setting(self, name):
         return self.marionette.execute_async_script('return GaiaDataLayer.getSetting("%s")' % name, special_powers=True)
@@ -172,25 +485,31 @@ class GaiaData(object):
         result = self.marionette.execute_async_script('return GaiaDataLayer.setSetting("%s", %s)' % (name, value), special_powers=True)
         assert result, "Unable to change setting with name '%s' to '%s'" % (name, value)
 
-    def set_volume(self, value):
+    def set_settings(self, settings):
+        result = self.marionette.execute_async_script('return GaiaDataLayer.setSettings(%s)' % json.dumps(settings), special_powers=True)
+        assert result, "Unable to change settings '%s'" % settings
+
+    def volume_settings(self, value):
         channels = ['master', 'content', 'notification', 'alarm', 'telephony', 'bt_sco']
-        for channel in channels:
-            self.set_setting('audio.volume.%s' % channel, value)
+        return dict(('audio.volume.%s' % channel, value) for channel in channels)
+
+    def set_volume(self, value):
+        self.set_settings(self.volume_settings(value))
 
     def bt_enable_bluetooth(self):
-        self.marionette.switch_to_frame()
-        return self.marionette.execute_async_script("return GaiaDataLayer.enableBluetooth()")
+        with in_top_frame(self.marionette):
+            return self.marionette.execute_async_script("return GaiaDataLayer.enableBluetooth()")
 
     def bt_disable_bluetooth(self):
-        self.marionette.switch_to_frame()
-        return self.marionette.execute_async_script("return GaiaDataLayer.disableBluetooth()")
+        with in_top_frame(self.marionette):
+            return self.marionette.execute_async_script("return GaiaDataLayer.disableBluetooth()")
 
     def bt_pair_bluetooth_device(self, device_name):
         return self.marionette.execute_async_script('return GaiaDataLayer.pairBluetoothDevice("%s")' % device_name)
 
     def bt_unpair_all_bluetooth_devices(self):
-        self.marionette.switch_to_frame()
-        self.marionette.execute_async_script('return GaiaDataLayer.unpairAllBluetoothDevices()')
+        with in_top_frame(self.marionette):
+            self.marionette.execute_async_script('return GaiaDataLayer.unpairAllBluetoothDevices()')
 
     @property
     def bt_is_bluetooth_enabled(self):
@@ -201,14 +520,14 @@ class GaiaData(object):
         return self.get_setting('ril.data.enabled')
 
     def connect_to_cell_data(self):
-        self.marionette.switch_to_frame()
-        result = self.marionette.execute_async_script("return GaiaDataLayer.connectToCellData()", special_powers=True)
-        assert result, 'Unable to connect to cell data'
+        with in_top_frame(self.marionette):
+            result = self.marionette.execute_async_script("return GaiaDataLayer.connectToCellData()", special_powers=True)
+            assert result, 'Unable to connect to cell data'
 
     def disable_cell_data(self):
-        self.marionette.switch_to_frame()
-        result = self.marionette.execute_async_script("return GaiaDataLayer.disableCellData()", special_powers=True)
-        assert result, 'Unable to disable cell data'
+        with in_top_frame(self.marionette):
+            result = self.marionette.execute_async_script("return GaiaDataLayer.disableCellData()", special_powers=True)
+            assert result, 'Unable to disable cell data'
 
     @property
     def is_cell_data_connected(self):
@@ -225,32 +544,32 @@ class GaiaData(object):
         return self.get_setting('wifi.enabled')
 
     def enable_wifi(self):
-        self.marionette.switch_to_frame()
-        result = self.marionette.execute_async_script("return GaiaDataLayer.enableWiFi()", special_powers=True)
-        assert result, 'Unable to enable WiFi'
+        with in_top_frame(self.marionette):
+            result = self.marionette.execute_async_script("return GaiaDataLayer.enableWiFi()", special_powers=True)
+            assert result, 'Unable to enable WiFi'
 
     def disable_wifi(self):
-        self.marionette.switch_to_frame()
-        result = self.marionette.execute_async_script("return GaiaDataLayer.disableWiFi()", special_powers=True)
-        assert result, 'Unable to disable WiFi'
+        with in_top_frame(self.marionette):
+            result = self.marionette.execute_async_script("return GaiaDataLayer.disableWiFi()", special_powers=True)
+            assert result, 'Unable to disable WiFi'
 
     def connect_to_wifi(self, network=None):
         network = network or self.testvars.get('wifi')
         assert network, 'No WiFi network provided'
         self.enable_wifi()
-        self.marionette.switch_to_frame()
-        result = self.marionette.execute_async_script("return GaiaDataLayer.connectToWiFi(%s)" % json.dumps(network))
-        assert result, 'Unable to connect to WiFi network'
+        with in_top_frame(self.marionette):
+            result = self.marionette.execute_async_script("return GaiaDataLayer.connectToWiFi(%s)" % json.dumps(network))
+            assert result, 'Unable to connect to WiFi network'
 
     def forget_all_networks(self):
-        self.marionette.switch_to_frame()
-        self.marionette.execute_async_script('return GaiaDataLayer.forgetAllNetworks()')
+        with in_top_frame(self.marionette):
+            self.marionette.execute_async_script('return GaiaDataLayer.forgetAllNetworks()')
 
     def is_wifi_connected(self, network=None):
         network = network or self.testvars.get('wifi')
         assert network, 'No WiFi network provided'
-        self.marionette.switch_to_frame()
-        return self.marionette.execute_script("return GaiaDataLayer.isWiFiConnected(%s)" % json.dumps(network))
+        with in_top_frame(self.marionette):
+            return self.marionette.execute_script("return GaiaDataLayer.isWiFiConnected(%s)" % json.dumps(network))
 
     @property
     def known_networks(self):
@@ -277,9 +596,9 @@ class GaiaData(object):
     def media_files(self):
         return self.marionette.execute_async_script('return GaiaDataLayer.getAllMediaFiles();')
 
-    def delete_all_sms(self):
-        self.marionette.switch_to_frame()
-        return self.marionette.execute_async_script("return GaiaDataLayer.deleteAllSms();", special_powers=True)
+    def delete_all_sms(self, concurrency=10):
+        with in_top_frame(self.marionette):
+            return self.marionette.execute_async_script("return GaiaDataLayer.deleteAllSms(null, %d);" % concurrency, special_powers=True)
 
     def delete_all_alarms(self):
         self.marionette.execute_script('GaiaDataLayer.deleteAllAlarms();')
@@ -295,6 +614,38 @@ class GaiaData(object):
 
 class GaiaDevice(object):
 
+    # longest command line in characters sent in a single adb shell call
+    _max_shell_command_length = 1000
+
+    # pushed files are kept on the device under their SHA-1 so later pushes of
+    # the same content are a local copy; set the size in bytes to 0 to disable
+    resource_cache_dir = '/data/local/tmp/gaiatest-cache'
+    resource_cache_size = 100 * 1024 * 1024
+
+    # cache of each device keyed by its serial: the sizes of the cached files
+    # keyed by SHA-1, least recently used first, whether their order changed
+    # since the index was written and the device to write it to
+    _resource_caches = {}
+
+    # file in the cache directory listing each cached SHA-1 with its size, as
+    # the columns of `ls -l` differ between toolbox and busybox
+    resource_cache_index = 'index'
+
+    # SHA-1 of local files keyed by (path, modification time)
+    _resource_hashes = {}
+
+    # hits and misses of the cache of each device keyed by its serial
+    resource_cache_stats = {}
+
+    # directories holding the data of B2G, removed to revert it to a clean state
+    data_dirs = ['/data/local/indexedDB', '/data/b2g/mozilla']
+
+    # archive of the data directories as left by the first clean start of B2G
+    snapshot_path = '/data/local/tmp/gaiatest-snapshot.tar'
+
+    # whether the snapshot has been taken, False if it could not be
+    _snapshot = None
+
     def __init__(self, marionette):
         self.marionette = marionette
 
@@ -318,6 +669,12 @@ class GaiaDevice(object):
             raise Exception('Unknown device manager type: %s' % dm_type)
         return self._manager
 
+    @property
+    def serial(self):
+        # the device adb talks to, or the host of SUT
+        return (getattr(self.manager, '_deviceSerial', None) or os.environ.get('ANDROID_SERIAL') or
+                getattr(self.manager, 'host', None) or '')
+
     @property
     def is_android_build(self):
         if not hasattr(self, '_is_android_build'):
@@ -339,20 +696,170 @@ class GaiaDevice(object):
             self._has_wifi = self.marionette.execute_script('return window.navigator.mozWifiManager !== undefined')
         return self._has_wifi
 
-    def push_file(self, source, count=1, destination='', progress=None):
+    def push_file(self, source, count=1, destination='', progress=None, jobs=4):
         if not destination.count('.') > 0:
             destination = '/'.join([destination, source.rpartition(os.path.sep)[-1]])
         self.manager.mkDirs(destination)
-        self.manager.pushFile(source, destination)
 
-        if count > 1:
-            for i in range(1, count + 1):
-                remote_copy = '_%s.'.join(iter(destination.split('.'))) % i
-                self.manager._checkCmd(['shell', 'dd', 'if=%s' % destination, 'of=%s' % remote_copy])
-                if progress:
-                    progress.update(i)
+        if count <= 1:
+            self._push(source, destination)
+            return
+
+        # push the file once as the first copy, then make the remaining
+        # copies on the device in a single shell call running `jobs` at a time
+        remote_copy = '_%s.'.join(iter(destination.split('.')))
+        self._push(source, remote_copy % 1)
+        if progress:
+            progress.update(1)
+
+        script = ('i=2; while [ $i -le %(count)d ]; do '
+                  'dd if="%(source)s" of="%(copy)s" 2>/dev/null & '
+                  'if [ $(((i - 1) %% %(jobs)d)) -eq 0 ]; then wait; fi; '
+                  'i=$((i + 1)); done; wait') % {
+                      'count': count,
+                      'source': remote_copy % 1,
+                      'copy': remote_copy % '${i}',
+                      'jobs': max(1, jobs)}
+        self.manager._checkCmd(['shell', script])
+        if progress:
+            progress.update(count)
+
+    def _push(self, source, destination):
+        if not self.resource_cache_size:
+            self.manager.pushFile(source, destination)
+            return
+
+        key = (source, os.path.getmtime(source))
+        if key not in GaiaDevice._resource_hashes:
+            with open(source, 'rb') as f:
+                GaiaDevice._resource_hashes[key] = hashlib.sha1(f.read()).hexdigest()
+        sha1 = GaiaDevice._resource_hashes[key]
+
+        cache = self._load_resource_cache()
+        files = cache['files']
+        stats = GaiaDevice.resource_cache_stats.setdefault(self.serial, {'hits': 0, 'misses': 0})
+        cached = '/'.join([self.resource_cache_dir, sha1])
+        if sha1 in files:
+            stats['hits'] += 1
+            # mark as most recently used, which the index records on the next
+            # miss or at the end of the run
+            files[sha1] = files.pop(sha1)
+            cache['dirty'] = True
+        else:
+            stats['misses'] += 1
+            self.manager.pushFile(source, cached)
+            files[sha1] = os.path.getsize(source)
+            self._evict_resource_cache()
+            self._save_resource_cache()
+        self.manager._checkCmd(['shell', 'dd', 'if=%s' % cached, 'of=%s' % destination])
+
+    def _load_resource_cache(self):
+        if self.serial not in GaiaDevice._resource_caches:
+            # the cache outlives the test run, so pick up what is on the device
+            cache = OrderedDict()
+            self.manager.mkDir(self.resource_cache_dir)
+            index = '/'.join([self.resource_cache_dir, self.resource_cache_index])
+            sizes = {}
+            try:
+                for line in self.manager.shellCheckOutput(['cat', index]).splitlines():
+                    fields = line.split()
+                    if len(fields) == 2 and fields[1].isdigit():
+                        sizes[fields[0]] = int(fields[1])
+            except mozdevice.DMError:
+                pass
+            names = self.manager.shellCheckOutput(['ls', self.resource_cache_dir]).split()
+            for name in names:
+                if name in sizes:
+                    cache[name] = sizes[name]
+            # files of unknown size could never be evicted, so drop them
+            self.remove_files(['/'.join([self.resource_cache_dir, name]) for name in names
+                               if name not in cache and name != self.resource_cache_index])
+            GaiaDevice._resource_caches[self.serial] = {'files': cache, 'dirty': False, 'device': self}
+            if len(cache) != len(sizes):
+                self._save_resource_cache()
+        return GaiaDevice._resource_caches[self.serial]
+
+    def _save_resource_cache(self):
+        cache = GaiaDevice._resource_caches[self.serial]
+        handle, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(handle, 'w') as f:
+                f.writelines('%s %d\n' % item for item in cache['files'].items())
+            self.manager.pushFile(path, '/'.join([self.resource_cache_dir, self.resource_cache_index]))
+        finally:
+            os.remove(path)
+        cache['dirty'] = False
+
+    @classmethod
+    def save_resource_caches(cls):
+        """Writes the index of each device whose cached files were used in a
+        different order since it was last written."""
+        for cache in cls._resource_caches.values():
+            if cache['dirty']:
+                try:
+                    cache['device']._save_resource_cache()
+                except mozdevice.DMError:
+                    # only the order of eviction is lost
+                    pass
+
+    def _evict_resource_cache(self):
+        cache = GaiaDevice._resource_caches[self.serial]['files']
+        evicted = []
+        while len(cache) > 1 and sum(cache.values()) > self.resource_cache_size:
+            sha1, size = cache.popitem(last=False)
+            evicted.append('/'.join([self.resource_cache_dir, sha1]))
+        self.remove_files(evicted)
+
+    def remove_files(self, paths):
+        # remove the files with as few shell invocations as the command line
+        # length limit allows, instead of one adb round trip per file
+        batch = []
+        length = 0
+        for path in paths:
+            quoted = "'%s'" % path.replace("'", "'\\''")
+            if batch and length + len(quoted) + 1 > self._max_shell_command_length:
+                self.manager._checkCmd(['shell', 'rm'] + batch)
+                batch = []
+                length = 0
+            batch.append(quoted)
+            length += len(quoted) + 1
+        if batch:
+            self.manager._checkCmd(['shell', 'rm'] + batch)
+
+    def reset_b2g(self):
+        """Restarts B2G with its data removed."""
+        self.stop_b2g()
+        if self.is_android_build:
+            # revert device to a clean state
+            for data_dir in self.data_dirs:
+                self.manager.removeDir(data_dir)
+        self.start_b2g()
 
-            self.manager.removeFile(destination)
+    def reset_b2g_from_snapshot(self):
+        """Restarts B2G with its data restored from a snapshot.
+
+        The first reset removes the data and takes the snapshot once B2G has
+        started cleanly, later resets extract it over the data directories,
+        which spares B2G from rebuilding its profile on every start.
+        """
+        if not self.is_android_build or GaiaDevice._snapshot is False:
+            return self.reset_b2g()
+
+        if GaiaDevice._snapshot is None:
+            self.reset_b2g()
+            self.stop_b2g()
+            try:
+                self.manager.shellCheckOutput(['tar', '-cf', self.snapshot_path] + self.data_dirs, timeout=600)
+                GaiaDevice._snapshot = True
+            except mozdevice.DMError:
+                traceback.print_exc()
+                GaiaDevice._snapshot = False
+        else:
+            self.stop_b2g()
+            self.manager._checkCmd(['shell', 'rm', '-r'] + self.data_dirs)
+            # the archive holds the paths relative to the root
+            self.manager.shellCheckOutput(['tar', '-xf', self.snapshot_path], cwd='/', timeout=600)
+        self.start_b2g()
 
     def restart_b2g(self):
         self.stop_b2g()
@@ -388,100 +895,492 @@ window.addEventListener('mozbrowserloadend', function loaded(aEvent) {
         else:
             raise Exception('Unable to stop B2G')
         self.marionette.client.close()
+        Atoms.forget(self.marionette)
         self.marionette.session = None
         self.marionette.window = None
 
 
+class DebugCapture(object):
+    """Captures the state of the device once when a test fails.
+
+    The screenshot, page source and settings are fetched on the first call
+    to capture() and shared by everything that reports the failure.
+    """
+
+    def __init__(self, marionette):
+        self.marionette = marionette
+        self.debug = None
+
+    def capture(self):
+        if self.debug is None:
+            self.debug = {}
+            try:
+                # TODO: Bug 818287 - Screenshots include data URL prefix
+                self.debug['screenshot'] = self.marionette.screenshot()[22:]
+            except:
+                traceback.print_exc()
+            try:
+                self.debug['source'] = self.marionette.page_source
+            except:
+                traceback.print_exc()
+            try:
+                # Switch to top frame in case we are in a 3rd party app
+                # There is no more debug gathering is not specific to the app
+                self.marionette.switch_to_frame()
+                self.debug['settings'] = json.dumps(self.marionette.execute_async_script("""
+SpecialPowers.addPermission('settings-read', true, document);
+var req = window.navigator.mozSettings.createLock().get('*');
+req.onsuccess = function() {
+  marionetteScriptFinished(req.result);
+}""", special_powers=True))
+            except:
+                traceback.print_exc()
+        return self.debug
+
+    def write(self, debug_path, test_name):
+        """Writes the captured state to files on a background thread, which
+        needs no more of the device and so runs alongside the teardown."""
+        debug = self.capture()
+        files = []
+        if 'screenshot' in debug:
+            files.append(('%s_screenshot.png' % test_name, base64.decodestring(debug['screenshot'])))
+        if 'source' in debug:
+            files.append(('%s_source.txt' % test_name, debug['source'].encode('utf-8')))
+        if 'settings' in debug:
+            files.append(('%s_settings.json' % test_name, debug['settings']))
+
+        def write_files():
+            for filename, content in files:
+                try:
+                    with open(os.path.join(debug_path, filename), 'w') as f:
+                        f.write(content)
+                except:
+                    traceback.print_exc()
+        writer = threading.Thread(target=write_files)
+        writer.start()
+        return writer
+
+
+class CommandTrace(object):
+    """Records the Marionette commands sent while tests run.
+
+    Each command is kept with the test and phase it ran in, the frame it was
+    sent to, its duration, the size of its payload and the page object method
+    that sent it. Tracing is off unless `enabled` is set.
+    """
+
+    enabled = False
+
+    # the commands recorded so far, as dicts
+    commands = []
+
+    # the test commands are attributed to, and its phase
+    test = None
+    phase = None
+
+    # the frame the last switchToFrame command selected
+    frame = None
+
+    _package = os.path.dirname(os.path.abspath(__file__))
+    _tests = os.path.join(_package, 'tests')
+    _base = os.path.join(_package, 'apps', 'base')
+    _library_files = {}
+
+    @classmethod
+    def start(cls, test, phase):
+        cls.test = test
+        cls.phase = phase
+
+    @classmethod
+    def _in_library(cls, filename):
+        if filename not in cls._library_files:
+            path = os.path.abspath(filename)
+            cls._library_files[filename] = path.startswith(cls._package) and not path.startswith(cls._tests)
+        return cls._library_files[filename]
+
+    @classmethod
+    def _passes_on(cls, frame, obj):
+        """Whether a library frame only passes a command on for the method that
+        called it: a wait and its conditions, or a helper of the page objects."""
+        code = frame.f_code
+        return (obj is None or isinstance(obj, (Wait, Marionette, DebugCapture)) or
+                code.co_name == '<lambda>' or bool(code.co_freevars) or
+                os.path.splitext(os.path.abspath(code.co_filename))[0] == cls._base)
+
+    @classmethod
+    def _caller(cls, frame):
+        """Returns the page object method that sent a command, and whether it
+        was sent while waiting."""
+        caller = None
+        waiting = False
+        while frame:
+            obj = frame.f_locals.get('self')
+            name = frame.f_code.co_name
+            if isinstance(obj, Wait) or name.startswith('wait_for'):
+                waiting = True
+            if not cls._in_library(frame.f_code.co_filename):
+                if caller is None and isinstance(obj, MarionetteTestCase):
+                    # sent by the test itself
+                    caller = name
+                if caller is not None:
+                    break
+            elif caller is None and not cls._passes_on(frame, obj):
+                caller = '%s.%s' % (obj.__class__.__name__, name)
+            frame = frame.f_back
+        return caller, waiting
+
+    @classmethod
+    def record(cls, command, kwargs, response, duration):
+        if command == 'switchToFrame':
+            cls.frame = kwargs.get('element') or kwargs.get('value')
+        caller, waiting = cls._caller(sys._getframe(2))
+        cls.commands.append({
+            'test': cls.test,
+            'phase': cls.phase == 'test' and (waiting and 'wait' or 'action') or cls.phase,
+            'command': command,
+            'frame': cls.frame,
+            'caller': caller,
+            'duration': duration,
+            'sent': len(json.dumps(kwargs)),
+            'received': len(json.dumps(response))})
+
+    @staticmethod
+    def summarize(commands):
+        """Totals the commands of each test: round trips and seconds per phase."""
+        tests = {}
+        for command in commands:
+            summary = tests.setdefault(command['test'], {
+                'round_trips': 0, 'setup': 0, 'wait': 0, 'action': 0, 'teardown': 0})
+            summary['round_trips'] += 1
+            summary[command['phase']] += command['duration']
+        return tests
+
+    @classmethod
+    def save(cls, path, commands=None):
+        commands = cls.commands if commands is None else commands
+        trace_dir = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(trace_dir):
+            os.makedirs(trace_dir)
+        with open(path, 'w') as f:
+            json.dump({'commands': commands, 'tests': cls.summarize(commands)}, f, indent=2)
+
+
+class FrameTracker(object):
+    """Mixin for the Marionette client that remembers the frames commands go to.
+
+    The client keeps the frames switched to on the way from the top frame,
+    as frames given by index, name or element are looked up from the frame
+    selected. Switching to the top frame when already there is skipped, as is
+    switching to the frame element already selected, so helpers can switch
+    defensively without a round trip each time; switches by index or name
+    always go through. frame() selects a frame for the length of a with block
+    and then selects again, starting from the top frame, the frames leading
+    to the one selected before it.
+    """
+
+    # stands for the frames when they are not known, forcing the next switch
+    _unknown = object()
+
+    # the frames switched to from the top frame, each with whether it was
+    # given focus, empty for the top frame
+    _frames = ()
+
+    # commands go to chrome rather than to the frames of the content
+    _chrome = False
+
+    def start_session(self, *args, **kwargs):
+        self._frames = ()
+        return super(FrameTracker, self).start_session(*args, **kwargs)
+
+    def delete_session(self):
+        self._frames = self._unknown
+        return super(FrameTracker, self).delete_session()
+
+    def set_context(self, context):
+        self._chrome = context == self.CONTEXT_CHROME
+        return super(FrameTracker, self).set_context(context)
+
+    @property
+    def current_frame(self):
+        if self._frames is self._unknown or not self._frames:
+            return None
+        return self._frames[-1][0]
+
+    def _is_current_frame(self, frame, focus):
+        if self._chrome or self._frames is self._unknown:
+            return False
+        if frame is None:
+            return not self._frames
+        if not isinstance(frame, HTMLElement) or not self._frames:
+            return False
+        current, focused = self._frames[-1]
+        return isinstance(current, HTMLElement) and current.id == frame.id and (focused or not focus)
+
+    def _path(self, frames):
+        return [(getattr(frame, 'id', frame), focus) for frame, focus in frames]
+
+    def switch_to_frame(self, frame=None, focus=True):
+        if self._is_current_frame(frame, focus):
+            return True
+        if self._chrome:
+            return super(FrameTracker, self).switch_to_frame(frame, focus)
+        frames, self._frames = self._frames, self._unknown
+        response = super(FrameTracker, self).switch_to_frame(frame, focus)
+        if frame is None:
+            self._frames = ()
+        elif frames is not self._unknown:
+            self._frames = frames + ((frame, focus),)
+        return response
+
+    @contextmanager
+    def frame(self, frame=None, focus=True):
+        previous = self._frames
+        self.switch_to_frame(frame, focus)
+        try:
+            yield
+        finally:
+            if (previous is self._unknown or self._frames is self._unknown or
+                    self._path(previous) != self._path(self._frames)):
+                # without the previous frames known, stay in the top frame
+                self.switch_to_frame()
+                if previous is not self._unknown:
+                    for frame, focus in previous:
+                        self.switch_to_frame(frame, focus)
+
+
+class TracedMarionette(object):
+    """Mixin for the Marionette client that records its commands in CommandTrace."""
+
+    def _send_message(self, command, response_key, **kwargs):
+        if not CommandTrace.enabled or CommandTrace.test is None:
+            return super(TracedMarionette, self)._send_message(command, response_key, **kwargs)
+        start = time.time()
+        response = None
+        try:
+            response = super(TracedMarionette, self)._send_message(command, response_key, **kwargs)
+            return response
+        finally:
+            CommandTrace.record(command, kwargs, response, time.time() - start)
+
+
 class GaiaTestCase(MarionetteTestCase):
 
     _script_timeout = 60000
     _search_timeout = 10000
 
-    # deafult timeout in seconds for the wait_for methods
-    _default_timeout = 30
+    # settings as left by the first cleanUp of the run
+    _settings_baseline = None
+
+    # settings that cleanUp restores through the data layer rather than by value
+    _unrestored_settings = ['wifi.enabled', 'ril.data.enabled', 'screen.timeout']
+
+    # prefixes of settings kept up to date by the system itself, which cleanUp
+    # neither restores nor reports as changed by a test
+    _system_settings = ['deviceinfo.', 'icc.', 'operatorvariant.', 'ril.lastKnown', 'time.nitz.']
+
+    # whether the previous test may have left media on the device, which is
+    # unknown at the start of the run
+    _media_dirty = True
+
+    # set by tests that create media on the device without push_resource
+    creates_media = False
+
+    # id of the last test that was set up and the settings it started with,
+    # None when they are not known, as after a restart or a failed setUp
+    _test_settings = None
+
+    # names of settings left changed by a test, keyed by test id
+    settings_drift = {}
+
+    # seconds spent in each phase of setting up a test, keyed by test id
+    phase_timings = {}
+
+    # the Marionette session kept open across tests, with the helpers set up
+    # for it, as a dict
+    _session_fixture = None
 
     def __init__(self, *args, **kwargs):
         self.restart = kwargs.pop('restart', False)
+        self.snapshot = kwargs.pop('snapshot', False)
+        self.debug_capture = None
         MarionetteTestCase.__init__(self, *args, **kwargs)
 
-    def setUp(self):
-        MarionetteTestCase.setUp(self)
-        self.marionette.__class__ = type('Marionette', (Marionette, MarionetteTouchMixin), {})
-
-        self.device = GaiaDevice(self.marionette)
-        if self.restart and (self.device.is_android_build or self.marionette.instance):
-            self.device.stop_b2g()
-            if self.device.is_android_build:
-                # revert device to a clean state
-                self.device.manager.removeDir('/data/local/indexedDB')
-                self.device.manager.removeDir('/data/b2g/mozilla')
-            self.device.start_b2g()
+    @contextmanager
+    def timed(self, phase):
+        """Adds the time spent in the block to the phase timings of the test."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            timings = GaiaTestCase.phase_timings.setdefault(self.id(), OrderedDict())
+            timings[phase] = timings.get(phase, 0) + time.time() - start
 
-        self.marionette.setup_touch()
+    def setUp(self):
+        CommandTrace.start(self.id(), 'setup')
+        with self.timed('session'):
+            MarionetteTestCase.setUp(self)
+        fixture = GaiaTestCase._session_fixture
+        if (self.restart or fixture is None or fixture['marionette'] is not self.marionette or
+                fixture['session'] != self.marionette.session):
+            fixture = self.set_up_session()
+        # a kept session is still in the frame the previous test left it in
+        self.marionette.switch_to_frame()
+        self.device = fixture['device']
+        self.lockscreen = fixture['lockscreen']
+        self.apps = fixture['apps']
+        self.data_layer = fixture['data_layer']
+        self.keyboard = fixture['keyboard']
 
         # the emulator can be really slow!
         self.marionette.set_script_timeout(self._script_timeout)
         self.marionette.set_search_timeout(self._search_timeout)
-        self.lockscreen = LockScreen(self.marionette)
-        self.apps = GaiaApps(self.marionette)
-        self.data_layer = GaiaData(self.marionette, self.testvars)
-        from gaiatest.apps.keyboard.app import Keyboard
-        self.keyboard = Keyboard(self.marionette)
 
         self.cleanUp()
+        with self.timed('settings'):
+            GaiaTestCase._test_settings = (self.id(), self.data_layer.all_settings)
+        CommandTrace.start(self.id(), 'test')
+
+    def set_up_session(self):
+        """Sets up the session and the helpers that are kept across tests,
+        restarting B2G first if asked to."""
+        bases = (FrameTracker, Marionette, MarionetteTouchMixin)
+        if CommandTrace.enabled:
+            bases = (TracedMarionette,) + bases
+        self.marionette.__class__ = type('Marionette', bases, {})
+
+        device = GaiaDevice(self.marionette)
+        if self.restart and (device.is_android_build or self.marionette.instance):
+            # the settings change with the restart rather than by a test
+            GaiaTestCase._test_settings = None
+            with self.timed('restart'):
+                if self.snapshot:
+                    device.reset_b2g_from_snapshot()
+                else:
+                    device.reset_b2g()
+
+        with self.timed('setup_touch'):
+            self.marionette.setup_touch()
+
+        with self.timed('helpers'):
+            from gaiatest.apps.keyboard.app import Keyboard
+            GaiaTestCase._session_fixture = {
+                'marionette': self.marionette,
+                'session': self.marionette.session,
+                'device': device,
+                'lockscreen': LockScreen(self.marionette),
+                'apps': GaiaApps(self.marionette),
+                'data_layer': GaiaData(self.marionette, self.testvars),
+                'keyboard': Keyboard(self.marionette)}
+        return GaiaTestCase._session_fixture
 
     def cleanUp(self):
-        # remove media
-        if self.device.is_android_build and self.data_layer.media_files:
-            for filename in self.data_layer.media_files:
-                # filename is a fully qualified path
-                self.device.manager.removeFile(filename)
+        # remove media, only looked for when the previous test may have left some
+        if self.device.is_android_build and GaiaTestCase._media_dirty:
+            with self.timed('remove_media'):
+                # media_files returns fully qualified paths
+                self.device.remove_files(self.data_layer.media_files or [])
+        GaiaTestCase._media_dirty = self.creates_media
+
+        # restore settings, the first test of the run resets them explicitly
+        # and later tests only write back the ones the last test changed
+        with self.timed('settings'):
+            if GaiaTestCase._settings_baseline is None:
+                self.reset_settings()
+            else:
+                self.restore_settings()
+
+        # unlock
+        with self.timed('unlock'):
+            self.lockscreen.unlock()
+
+        # kill any open apps
+        with self.timed('kill_all'):
+            self.apps.kill_all()
+
+        # disable carrier data connection
+        if self.device.has_mobile_connection:
+            with self.timed('disable_cell_data'):
+                self.data_layer.disable_cell_data()
+
+        if self.device.has_wifi:
+            with self.timed('enable_wifi'):
+                self.data_layer.enable_wifi()
+            with self.timed('forget_all_networks'):
+                self.data_layer.forget_all_networks()
+            with self.timed('disable_wifi'):
+                self.data_layer.disable_wifi()
+
+        # remove data
+        with self.timed('remove_contacts'):
+            self.data_layer.remove_all_contacts(self._script_timeout)
+
+        # reset to home screen
+        with self.timed('home'):
+            self.marionette.execute_script("window.wrappedJSObject.dispatchEvent(new Event('home'));")
+
+        if GaiaTestCase._settings_baseline is None:
+            with self.timed('settings'):
+                GaiaTestCase._settings_baseline = self.data_layer.all_settings
+
+    def reset_settings(self):
+        # settings are written in a single lock, later entries override earlier ones
+        settings = []
 
         if self.data_layer.get_setting('ril.radio.disabled'):
             # enable the device radio, disable Airplane mode
-            self.data_layer.set_setting('ril.radio.disabled', False)
+            settings.append(('ril.radio.disabled', False))
 
         # disable passcode before restore settings from testvars
-        self.data_layer.set_setting('lockscreen.passcode-lock.code', '1111')
-        self.data_layer.set_setting('lockscreen.passcode-lock.enabled', False)
+        settings.append(('lockscreen.passcode-lock.code', '1111'))
+        settings.append(('lockscreen.passcode-lock.enabled', False))
 
         # Change language back to English
-        self.data_layer.set_setting("language.current", "en-US")
+        settings.append(('language.current', 'en-US'))
 
         # Switch off spanish keyboard before test
-        self.data_layer.set_setting("keyboard.layouts.spanish", False)
+        settings.append(('keyboard.layouts.spanish', False))
 
         # Change timezone back to PST
-        self.data_layer.set_setting("time.timezone", "America/Los_Angeles")
+        settings.append(('time.timezone', 'America/Los_Angeles'))
 
         # restore settings from testvars
-        [self.data_layer.set_setting(name, value) for name, value in self.testvars.get('settings', {}).items()]
+        settings.extend(self.testvars.get('settings', {}).items())
 
-        # unlock
-        self.lockscreen.unlock()
+        # disable sound completely
+        settings.extend(self.data_layer.volume_settings(0).items())
 
-        # kill any open apps
-        self.apps.kill_all()
+        # disable cell roaming
+        settings.append(('ril.data.roaming_enabled', False))
 
-        # disable sound completely
-        self.data_layer.set_volume(0)
+        self.data_layer.set_settings(dict(settings))
 
-        # disable carrier data connection
-        if self.device.has_mobile_connection:
-            self.data_layer.disable_cell_data()
+    def _restorable_setting(self, name):
+        return (name not in self._unrestored_settings and
+                not any(name.startswith(prefix) for prefix in self._system_settings))
 
-        self.data_layer.disable_cell_roaming()
+    def restore_settings(self):
+        current = self.data_layer.all_settings
+        if GaiaTestCase._test_settings is None:
+            # without the settings the last test started with, compare with
+            # the baseline and put the changes down to no test
+            test, before = None, GaiaTestCase._settings_baseline
+        else:
+            test, before = GaiaTestCase._test_settings
+        GaiaTestCase._test_settings = None
 
-        if self.device.has_wifi:
-            self.data_layer.enable_wifi()
-            self.data_layer.forget_all_networks()
-            self.data_layer.disable_wifi()
+        drifted = dict((name, value) for name, value in before.items()
+                       if self._restorable_setting(name) and current.get(name) != value)
+        # mozSettings cannot remove a single setting, so added ones are reset
+        # to null, which is what reading an unknown setting gives
+        added = dict((name, None) for name, value in current.items()
+                     if name not in before and value is not None and self._restorable_setting(name))
 
-        # remove data
-        self.data_layer.remove_all_contacts(self._script_timeout)
+        if (drifted or added) and test:
+            GaiaTestCase.settings_drift[test] = sorted(drifted.keys() + added.keys())
 
-        # reset to home screen
-        self.marionette.execute_script("window.wrappedJSObject.dispatchEvent(new Event('home'));")
+        drifted.update(added)
+        if drifted:
+            self.data_layer.set_settings(drifted)
 
     def install_marketplace(self):
         _yes_button_locator = ('id', 'app-install-install-button')
@@ -518,6 +1417,7 @@ class GaiaTestCase(MarionetteTestCase):
                 raise Exception('Unable to connect to local area network')
 
     def push_resource(self, filename, count=1, destination=''):
+        GaiaTestCase._media_dirty = True
         self.device.push_file(self.resource(filename), count, '/'.join(['sdcard', destination]))
 
     def resource(self, filename):
@@ -557,77 +1457,23 @@ class GaiaTestCase(MarionetteTestCase):
     def screen_orientation(self):
         return self.marionette.execute_script('return window.screen.mozOrientation')
 
-    def wait_for_element_present(self, by, locator, timeout=_default_timeout):
-        timeout = float(timeout) + time.time()
-
-        while time.time() < timeout:
-            time.sleep(0.5)
-            try:
-                return self.marionette.find_element(by, locator)
-            except NoSuchElementException:
-                pass
-        else:
-            raise TimeoutException(
-                'Element %s not found before timeout' % locator)
-
-    def wait_for_element_not_present(self, by, locator, timeout=_default_timeout):
-        timeout = float(timeout) + time.time()
+    def wait_for_element_present(self, by, locator, timeout=None, interval=None):
+        return Wait(self.marionette, timeout, interval).for_element_present(by, locator)
 
-        while time.time() < timeout:
-            time.sleep(0.5)
-            try:
-                self.marionette.find_element(by, locator)
-            except NoSuchElementException:
-                break
-        else:
-            raise TimeoutException(
-                'Element %s still present after timeout' % locator)
+    def wait_for_element_not_present(self, by, locator, timeout=None, interval=None):
+        Wait(self.marionette, timeout, interval).for_element_not_present(by, locator)
 
-    def wait_for_element_displayed(self, by, locator, timeout=_default_timeout):
-        timeout = float(timeout) + time.time()
+    def wait_for_element_displayed(self, by, locator, timeout=None, interval=None):
+        Wait(self.marionette, timeout, interval).for_element_displayed(by, locator)
 
-        while time.time() < timeout:
-            time.sleep(0.5)
-            try:
-                if self.marionette.find_element(by, locator).is_displayed():
-                    break
-            except (NoSuchElementException, StaleElementException):
-                pass
-        else:
-            raise TimeoutException(
-                'Element %s not visible before timeout' % locator)
+    def wait_for_element_not_displayed(self, by, locator, timeout=None, interval=None):
+        Wait(self.marionette, timeout, interval).for_element_not_displayed(by, locator)
 
-    def wait_for_element_not_displayed(self, by, locator, timeout=_default_timeout):
-        timeout = float(timeout) + time.time()
-
-        while time.time() < timeout:
-            time.sleep(0.5)
-            try:
-                if not self.marionette.find_element(by, locator).is_displayed():
-                    break
-            except StaleElementException:
-                pass
-            except NoSuchElementException:
-                break
-        else:
-            raise TimeoutException(
-                'Element %s still visible after timeout' % locator)
-
-    def wait_for_condition(self, method, timeout=_default_timeout,
-                           message="Condition timed out"):
+    def wait_for_condition(self, method, timeout=None,
+                           message="Condition timed out", interval=None):
         """Calls the method provided with the driver as an argument until the \
         return value is not False."""
-        end_time = time.time() + timeout
-        while time.time() < end_time:
-            try:
-                value = method(self.marionette)
-                if value:
-                    return value
-            except (NoSuchElementException, StaleElementException):
-                pass
-            time.sleep(0.5)
-        else:
-            raise TimeoutException(message)
+        return Wait(self.marionette, timeout, interval).until(method, message)
 
     def is_element_present(self, by, locator):
         try:
@@ -642,7 +1488,14 @@ class GaiaTestCase(MarionetteTestCase):
         except (NoSuchElementException, ElementNotVisibleException):
             return False
 
+    def capture_debug(self):
+        """Returns the state of the device at the failure, capturing it on first use."""
+        if self.debug_capture is None:
+            self.debug_capture = DebugCapture(self.marionette)
+        return self.debug_capture.capture()
+
     def tearDown(self):
+        CommandTrace.start(self.id(), 'teardown')
         if any(sys.exc_info()):
             # test has failed, gather debug
             test_class, test_name = self.marionette.test_name.split()[-1].split('.')
@@ -650,35 +1503,30 @@ class GaiaTestCase(MarionetteTestCase):
             debug_path = os.path.join(xml_output and os.path.dirname(xml_output) or 'debug', test_class)
             if not os.path.exists(debug_path):
                 os.makedirs(debug_path)
-
-            # screenshot
-            try:
-                with open(os.path.join(debug_path, '%s_screenshot.png' % test_name), 'w') as f:
-                    # TODO: Bug 818287 - Screenshots include data URL prefix
-                    screenshot = self.marionette.screenshot()[22:]
-                    f.write(base64.decodestring(screenshot))
-            except:
-                traceback.print_exc()
-
-            # page source
-            try:
-                with open(os.path.join(debug_path, '%s_source.txt' % test_name), 'w') as f:
-                    f.write(self.marionette.page_source.encode('utf-8'))
-            except:
-                traceback.print_exc()
-
-            # settings
-            # Switch to top frame in case we are in a 3rd party app
-            # There is no more debug gathering is not specific to the app
-            self.marionette.switch_to_frame()
-
-            try:
-                with open(os.path.join(debug_path, '%s_settings.json' % test_name), 'w') as f:
-                    f.write(json.dumps(self.data_layer.all_settings))
-            except:
-                traceback.print_exc()
+            self.capture_debug()
+            self.debug_capture.write(debug_path, test_name)
 
         self.lockscreen = None
         self.apps = None
         self.data_layer = None
-        MarionetteTestCase.tearDown(self)
+
+        # as MarionetteTestCase.tearDown, which in the pinned client also
+        # deletes the session rather than leaving that to cleanTest
+        self.marionette.set_context('content')
+        self.marionette.execute_script("log('TEST-END: %s:%s')" %
+                                       (self.filepath.replace('\\', '\\\\'), self.methodName))
+        self.marionette.test_name = None
+        self.cleanTest()
+
+    def cleanTest(self):
+        # keep the session open for the next test, only collecting its logs,
+        # clients calling cleanTest after tearDown find it already done
+        if self.marionette is None:
+            return
+        self.duration = time.time() - self.start_time
+        if self.marionette.session is not None:
+            try:
+                self.loglines = self.marionette.get_logs()
+            except Exception, inst:
+                self.loglines = [['Error getting log: %s' % inst]]
+        self.marionette = None
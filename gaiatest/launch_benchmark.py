@@ -0,0 +1,173 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import math
+from optparse import OptionParser
+import os
+import sys
+
+from marionette import Marionette
+
+from gaiatest import GaiaApps
+from gaiatest import LockScreen
+from gaiatest.runtests import percentile
+
+
+class LaunchBenchmark(object):
+    """Launches apps repeatedly and collects how long they took to load.
+
+    A cold launch starts the app after it has been killed, a warm launch
+    brings it back from the background after returning to the homescreen.
+    The load time is the one reported by the apploadtime event of the system
+    app, the launch time the milliseconds from launching to the app being
+    displayed.
+    """
+
+    measures = ['load_time', 'launch_time']
+
+    # as set for tests, so slow launches are measured rather than timing out
+    script_timeout = 60000
+
+    def __init__(self, marionette, iterations=5):
+        self.marionette = marionette
+        self.iterations = iterations
+        self.marionette.set_script_timeout(self.script_timeout)
+        self.apps = GaiaApps(self.marionette)
+
+    def home(self):
+        self.marionette.switch_to_frame()
+        self.marionette.execute_script("window.wrappedJSObject.dispatchEvent(new Event('home'));")
+
+    def sample(self, app):
+        load_time = app.load_time and app.load_time.get('time')
+        return {'load_time': load_time, 'launch_time': app.launch_time}
+
+    def run_app(self, name):
+        samples = {'cold': [], 'warm': []}
+        self.apps.kill_all()
+        for i in range(self.iterations):
+            app = self.apps.launch(name, switch_to_frame=False)
+            samples['cold'].append(self.sample(app))
+            self.apps.kill(app)
+
+        app = self.apps.launch(name, switch_to_frame=False)
+        for i in range(self.iterations):
+            self.home()
+            app = self.apps.launch(name, switch_to_frame=False)
+            samples['warm'].append(self.sample(app))
+        self.apps.kill(app)
+        return samples
+
+    def run(self, names):
+        return dict((name, self.run_app(name)) for name in names)
+
+    @classmethod
+    def summarize(cls, results):
+        """Reduces the samples of each app and launch type to their median,
+        90th percentile and standard deviation."""
+        summary = {}
+        for name, launches in results.items():
+            for launch, samples in launches.items():
+                for measure in cls.measures:
+                    values = [sample[measure] for sample in samples if sample[measure] is not None]
+                    if not values:
+                        continue
+                    mean = float(sum(values)) / len(values)
+                    summary.setdefault(name, {}).setdefault(launch, {})[measure] = {
+                        'samples': len(values),
+                        'median': percentile(values, 50),
+                        'p90': percentile(values, 90),
+                        'stddev': math.sqrt(sum((value - mean) ** 2 for value in values) / len(values))}
+        return summary
+
+    @classmethod
+    def regressions(cls, summary, baseline, threshold):
+        """Returns a message for each median that grew by more than threshold
+        percent over the baseline."""
+        messages = []
+        for name, launches in sorted(summary.items()):
+            for launch, measures in sorted(launches.items()):
+                for measure, statistics in sorted(measures.items()):
+                    try:
+                        expected = baseline[name][launch][measure]['median']
+                    except KeyError:
+                        continue
+                    if statistics['median'] > expected * (1 + threshold / 100.0):
+                        messages.append('%s %s %s: median %dms, baseline %dms' % (
+                            name, launch, measure, statistics['median'], expected))
+        return messages
+
+
+class LaunchBenchmarkOptions(OptionParser):
+
+    def __init__(self, **kwargs):
+        OptionParser.__init__(self, usage='%prog [options] [app name ...]', **kwargs)
+        self.add_option('--address',
+                        action='store',
+                        dest='address',
+                        default='localhost:2828',
+                        help='host:port of running Gecko instance to connect to')
+        self.add_option('--iterations',
+                        action='store',
+                        type='int',
+                        dest='iterations',
+                        default=5,
+                        help='number of cold and of warm launches of each app')
+        self.add_option('--output',
+                        action='store',
+                        dest='output',
+                        help='file to write the statistics to as JSON')
+        self.add_option('--baseline',
+                        action='store',
+                        dest='baseline',
+                        help='JSON statistics of an earlier run to check for regressions against')
+        self.add_option('--save-baseline',
+                        action='store_true',
+                        dest='save_baseline',
+                        default=False,
+                        help='write the statistics to the baseline file instead of checking against it')
+        self.add_option('--threshold',
+                        action='store',
+                        type='float',
+                        dest='threshold',
+                        default=10,
+                        help='percentage a median may exceed its baseline by before it is a regression')
+
+
+def main():
+    parser = LaunchBenchmarkOptions()
+    options, names = parser.parse_args()
+    host, port = options.address.split(':')
+    marionette = Marionette(host=host, port=int(port))
+    marionette.start_session()
+
+    LockScreen(marionette).unlock()
+    benchmark = LaunchBenchmark(marionette, options.iterations)
+    names = names or benchmark.apps.installed_app_names
+    summary = LaunchBenchmark.summarize(benchmark.run(names))
+
+    for name, launches in sorted(summary.items()):
+        for launch, measures in sorted(launches.items()):
+            for measure, statistics in sorted(measures.items()):
+                print '%s %s %s: median %dms, p90 %dms, stddev %.1fms' % (
+                    name, launch, measure, statistics['median'], statistics['p90'], statistics['stddev'])
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+    if options.baseline and options.save_baseline:
+        with open(options.baseline, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    elif options.baseline and os.path.exists(options.baseline):
+        with open(options.baseline) as f:
+            regressions = LaunchBenchmark.regressions(summary, json.load(f), options.threshold)
+        if regressions:
+            print '\nRegressions over %g%% against %s:' % (options.threshold, options.baseline)
+            print '\n'.join(regressions)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
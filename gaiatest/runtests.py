@@ -4,12 +4,19 @@
 
 import cgi
 import datetime
+import hashlib
 import json
+import math
+import multiprocessing
 import os
-import sys
+import Queue
+import shutil
 import textwrap
+import threading
 import time
+import traceback
 import base64
+from collections import OrderedDict
 
 from py.xml import html
 from py.xml import raw
@@ -19,32 +26,372 @@ from marionette import MarionetteTestRunner
 from marionette import MarionetteTextTestRunner
 from marionette.runtests import cli
 
+from gaiatest import CommandTrace
+from gaiatest import DebugCapture
+from gaiatest import GaiaDevice
 from gaiatest import GaiaTestCase
+from gaiatest import Wait
 
 
 class GaiaTestResult(MarionetteTestResult):
 
     def addError(self, test, err):
-        self.errors.append((test, self._exc_info_to_string(err, test), self.gather_debug()))
+        self.errors.append((test, self._exc_info_to_string(err, test), self.gather_debug(test)))
 
     def addFailure(self, test, err):
-        self.failures.append((test, self._exc_info_to_string(err, test), self.gather_debug()))
-
-    def gather_debug(self):
-        debug = {}
-        try:
-            debug['screenshot'] = self.marionette.screenshot()[22:]
-            debug['source'] = self.marionette.page_source
-            self.marionette.switch_to_frame()
-            debug['settings'] = json.dumps(self.marionette.execute_async_script("""
-SpecialPowers.addPermission('settings-read', true, document);
-var req = window.navigator.mozSettings.createLock().get('*');
-req.onsuccess = function() {
-  marionetteScriptFinished(req.result);
-}""", special_powers=True))
-        except:
-            pass
-        return debug
+        self.failures.append((test, self._exc_info_to_string(err, test), self.gather_debug(test)))
+
+    def gather_debug(self, test):
+        # share the capture with the test, which writes it out in tearDown
+        if hasattr(test, 'capture_debug'):
+            return test.capture_debug()
+        return DebugCapture(self.marionette).capture()
+
+
+class TestRecord(object):
+    """Stand-in for a test that ran in another process, carrying what the reports use."""
+
+    def __init__(self, name, duration, filepath=None):
+        self.name = name
+        self.duration = duration
+        self.filepath = filepath
+
+    def __unicode__(self):
+        return self.name
+
+    def __str__(self):
+        return self.name.encode('utf-8')
+
+    @classmethod
+    def create(cls, class_name, name, duration, filepath=None):
+        # the reports group by test class name, so the record takes it over
+        return type(str(class_name), (cls,), {})(name, duration, filepath)
+
+
+class ShardResults(object):
+    """Results reduced to plain data, of a shard worker or of tests already in
+    the HTML report, shaped like a GaiaTestResult for the reports."""
+
+    def __init__(self, summary):
+        record = lambda data: TestRecord.create(*data)
+        self.testsRun = summary['testsRun']
+        self.tests_passed = [record(test) for test in summary['tests_passed']]
+        self.unexpectedSuccesses = [record(test) for test in summary['unexpectedSuccesses']]
+        for name in ['failures', 'errors', 'skipped', 'expectedFailures']:
+            setattr(self, name, [(record(result[0]),) + tuple(result[1:]) for result in summary[name]])
+
+    @staticmethod
+    def summarize(results, debug=True):
+        """Reduces a test result to plain data that can be sent between processes,
+        leaving out the debug state of failures unless `debug` is set."""
+        end = None if debug else 2
+        record = lambda test: (test.__class__.__name__, unicode(test), getattr(test, 'duration', 0),
+                               getattr(test, 'filepath', None))
+        summary = {'testsRun': results.testsRun,
+                   'tests_passed': [record(test) for test in results.tests_passed],
+                   'unexpectedSuccesses': [record(test) for test in getattr(results, 'unexpectedSuccesses', [])]}
+        for name in ['failures', 'errors', 'skipped', 'expectedFailures']:
+            summary[name] = [(record(result[0]),) + tuple(result[1:end]) for result in getattr(results, name, [])]
+        return summary
+
+
+class TestDurations(object):
+    """Durations of the tests in previous runs, used to start the longest tests first."""
+
+    # where sharded runs keep the durations unless told otherwise
+    default_path = os.path.join(os.path.expanduser('~'), '.gaiatest', 'durations.json')
+
+    def __init__(self, path):
+        self.path = path
+        # test durations in seconds keyed by test file and then by test
+        self.durations = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.durations = json.load(f)
+
+    def of_file(self, filepath):
+        tests = self.durations.get(os.path.abspath(filepath))
+        if tests:
+            return sum(tests.values())
+
+    def schedule(self, tests):
+        """Orders test files longest first, keeping files without history in
+        their original order ahead of the others."""
+        unknown = [test for test in tests if self.of_file(test) is None]
+        known = [test for test in tests if self.of_file(test) is not None]
+        return unknown + sorted(known, key=self.of_file, reverse=True)
+
+    def update(self, results_list):
+        for results in results_list:
+            tests = results.tests_passed + getattr(results, 'unexpectedSuccesses', [])
+            for name in ['failures', 'errors', 'expectedFailures']:
+                tests += [result[0] for result in getattr(results, name, [])]
+            for test in tests:
+                if getattr(test, 'filepath', None):
+                    self.durations.setdefault(os.path.abspath(test.filepath), {})[unicode(test)] = test.duration
+
+    def save(self):
+        durations_dir = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(durations_dir):
+            os.makedirs(durations_dir)
+        with open(self.path, 'w') as f:
+            json.dump(self.durations, f, indent=2, sort_keys=True)
+
+
+def percentile(values, percent):
+    """Returns the nearest-rank percentile of the values, None without any."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, int(math.ceil(percent / 100.0 * len(values))) - 1)]
+
+
+def summarize_phases(timings):
+    """Aggregates the phase timings of the tests, keyed by test id, per phase."""
+    phases = OrderedDict()
+    for test in sorted(timings):
+        for phase, duration in timings[test].items():
+            phases.setdefault(phase, []).append(duration)
+    return OrderedDict((phase, {'tests': len(durations),
+                                'total': sum(durations),
+                                'median': percentile(durations, 50),
+                                'p90': percentile(durations, 90),
+                                'max': max(durations)})
+                       for phase, durations in phases.items())
+
+
+def run_shard(address, tests, kwargs, claimed, lock, queue):
+    """Runs the tests against one target, taking each test only if no other shard has."""
+    serial, _, address = address.rpartition('@')
+    if serial:
+        # adb picks the device to talk to from the environment
+        os.environ['ANDROID_SERIAL'] = serial
+    runner = GaiaTestRunner(address=address, shard=(claimed, lock, queue), **kwargs)
+    try:
+        runner.run_tests(tests)
+    finally:
+        runner.report_results()
+        queue.put(('done', runner.passed, runner.failed, runner.todo, runner.skipped,
+                   CommandTrace.commands, GaiaTestCase.phase_timings, GaiaDevice.resource_cache_stats,
+                   GaiaTestCase.settings_drift))
+
+
+class HTMLReportWriter(object):
+    """Writes the HTML report a row at a time as results arrive.
+
+    Until finish() is called the report holds the rows written so far, so a
+    run that dies midway still leaves a readable, if unsummarised, report.
+    Debug artifacts are written to a directory next to the report, named by
+    the hash of their content so identical screenshots are stored once.
+    """
+
+    artifact_extensions = {'screenshot': 'png', 'settings': 'json'}
+
+    def __init__(self, path):
+        self.path = path
+        self.artifacts = '%s_artifacts' % os.path.splitext(self.path)[0]
+        self.written = set()
+        # screenshots are decoded and written by a background thread so the
+        # rows keep pace with the tests
+        self.pending = Queue.Queue()
+        self.writer = threading.Thread(target=self._write_pending)
+        self.writer.daemon = True
+        self.writer.start()
+        self.tests = 0
+        self.passes = 0
+        self.failures = 0
+        self.skips = 0
+        self.errors = 0
+
+        html_dir = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(html_dir):
+            os.makedirs(html_dir)
+        self.file = open(self.path, 'w')
+        self.file.write(self._start(html.p('Report in progress, generated rows follow.')))
+        self.rows_start = self.file.tell()
+        self.file.flush()
+
+    def _start(self, *summary):
+        resources = os.path.abspath(os.path.join(os.path.dirname(__file__), 'resources'))
+        head = html.head(
+            html.meta(charset='utf-8'),
+            html.title('Test Report'),
+            html.link(rel='stylesheet', href=os.path.join(resources, 'style.css')),
+            html.script(src=os.path.join(resources, 'jquery.js')),
+            html.script(src=os.path.join(resources, 'main.js')))
+        table_head = html.thead(
+            html.tr([
+                html.th('Result', class_='sortable', col='result'),
+                html.th('Class', class_='sortable', col='class'),
+                html.th('Test Name', class_='sortable', col='name'),
+                html.th('Duration', class_='sortable numeric', col='duration'),
+                html.th('Links')]), id='results-table-head')
+        return ('<html>\n%s\n<body>\n%s\n<table id="results-table">\n%s\n<tbody id="results-table-body">\n' % (
+            head.unicode(indent=2),
+            '\n'.join(element.unicode(indent=2) for element in summary),
+            table_head.unicode(indent=2))).encode('utf-8')
+
+    _end = '</tbody>\n</table>\n</body>\n</html>\n'
+
+    def _write_pending(self):
+        while True:
+            path, content, encoded = self.pending.get()
+            try:
+                with open(path, 'wb') as f:
+                    f.write(base64.b64decode(content) if encoded else content)
+            except:
+                traceback.print_exc()
+            finally:
+                self.pending.task_done()
+
+    def artifact(self, name, content):
+        """Stores a debug artifact and returns its location relative to the report."""
+        extension = 'txt'
+        for kind, kind_extension in self.artifact_extensions.items():
+            if kind in name:
+                extension = kind_extension
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        filename = '%s.%s' % (hashlib.sha1(content).hexdigest(), extension)
+        path = os.path.join(self.artifacts, filename)
+        if filename not in self.written:
+            if not os.path.exists(self.artifacts):
+                os.makedirs(self.artifacts)
+            if not os.path.exists(path):
+                # screenshots arrive base64 encoded
+                self.pending.put((path, content, extension == 'png'))
+            self.written.add(filename)
+        return '%s/%s' % (os.path.basename(self.artifacts), filename)
+
+    def _row(self, test, text='', result='passed', debug=None):
+        if isinstance(text, str):
+            text = text.decode('utf-8', 'replace')
+        cls_name = test.__class__.__name__
+        tc_name = unicode(test).split()[0]
+        tc_time = str(test.duration)
+        additional_html = []
+        links_html = []
+
+        if result in ['failure', 'error', 'skipped']:
+            if debug and debug.get('screenshot'):
+                screenshot = self.artifact('screenshot', debug['screenshot'])
+                additional_html.append(
+                    html.div(
+                        html.a(html.img(src=screenshot), href=screenshot), class_='screenshot'))
+            for name, content in (debug or {}).items():
+                try:
+                    links_html.append(html.a(name, href=self.artifact(name, content)))
+                    links_html.append(' ')
+                except:
+                    pass
+
+            log = html.div(class_=result)
+            for line in text.splitlines():
+                separator = line.startswith(' ' * 10)
+                if separator:
+                    log.append(line[:80])
+                else:
+                    if line.lower().find("error") != -1 or line.lower().find("exception") != -1:
+                        log.append(html.span(raw(cgi.escape(line)), class_='error'))
+                    else:
+                        log.append(raw(cgi.escape(line)))
+                log.append(html.br())
+            additional_html.append(log)
+
+        row = html.tr([
+            html.td(result, class_='col-result'),
+            html.td(cls_name, class_='col-class'),
+            html.td(tc_name, class_='col-name'),
+            html.td(tc_time, class_='col-duration'),
+            html.td(links_html, class_='col-links'),
+            html.td(additional_html, class_='debug')],
+            class_=result.lower() + ' results-table-row')
+        self.file.write(row.unicode(indent=2).encode('utf-8') + '\n')
+
+    def _commands(self, commands):
+        phases = ['setup', 'action', 'wait', 'teardown']
+        rows = []
+        for test, summary in sorted(commands.items(), key=lambda item: -sum(item[1][phase] for phase in phases)):
+            rows.append(html.tr(
+                [html.td(test), html.td(summary['round_trips'])] +
+                [html.td('%.2f' % summary[phase]) for phase in phases]))
+        return [
+            html.h2('Marionette commands'),
+            html.p('%i round trips' % sum(summary['round_trips'] for summary in commands.values())),
+            html.table(
+                html.thead(html.tr([html.th('Test'), html.th('Round trips')] +
+                                   [html.th('%s (s)' % phase.capitalize()) for phase in phases])),
+                html.tbody(rows), id='commands-table')]
+
+    def _phases(self, timings):
+        phases = summarize_phases(timings)
+        statistics = ['total', 'median', 'p90', 'max']
+        return [
+            html.h2('Setup phases'),
+            html.table(
+                html.thead(html.tr([html.th('Phase'), html.th('Tests')] +
+                                   [html.th('%s (s)' % statistic.capitalize()) for statistic in statistics])),
+                html.tbody([html.tr([html.td(phase), html.td(summary['tests'])] +
+                                    [html.td('%.2f' % summary[statistic]) for statistic in statistics])
+                            for phase, summary in phases.items()]), id='phases-table'),
+            html.table(
+                html.thead(html.tr([html.th('Test')] + [html.th('%s (s)' % phase) for phase in phases])),
+                html.tbody([html.tr([html.td(test)] +
+                                    [html.td(phase in timings[test] and '%.2f' % timings[test][phase] or '')
+                                     for phase in phases])
+                            for test in sorted(timings)]), id='test-phases-table')]
+
+    def add_results(self, results):
+        self.tests += results.testsRun
+        self.failures += len(results.failures) + len(getattr(results, 'unexpectedSuccesses', []))
+        self.skips += len(results.skipped) + len(results.expectedFailures)
+        self.errors += len(results.errors)
+
+        for test in results.tests_passed:
+            self._row(test)
+            self.passes += 1
+        for result in results.failures:
+            self._row(result[0], text=result[1], result='failure', debug=len(result) > 2 and result[2] or None)
+        for result in results.errors:
+            self._row(result[0], text=result[1], result='error', debug=len(result) > 2 and result[2] or None)
+        self.file.flush()
+
+    def finish(self, elapsedtime, commands=None, phase_timings=None):
+        """Rewrites the report with the summary, copying the rows across.
+
+        `commands` optionally holds the Marionette round trips of each test,
+        as summarized by CommandTrace, and `phase_timings` the time each test
+        spent in the phases of its setup.
+        """
+        self.file.close()
+        self.pending.join()
+        generated = datetime.datetime.now()
+        summary = [
+            html.p('Report generated on %s at %s' % (
+                generated.strftime('%d-%b-%Y'),
+                generated.strftime('%H:%M:%S'))),
+            html.h2('Summary'),
+            html.p('%i tests ran. in %i seconds' % (self.tests, elapsedtime.total_seconds()),
+                   html.br(),
+                   html.span('%i passed' % self.passes, class_='passed'), ', ',
+                   html.span('%i failed' % self.failures, class_='failed'), ', ',
+                   html.span('%i skipped' % self.skips, class_='skipped'), ', ',
+                   html.span('%i error' % self.errors, class_='error'),
+                   html.br()),
+            html.h2('Results')]
+        if commands:
+            summary[-1:-1] = self._commands(commands)
+        if phase_timings:
+            summary[-1:-1] = self._phases(phase_timings)
+
+        report = '%s.tmp' % self.path
+        with open(report, 'w') as f:
+            f.write(self._start(*summary))
+            with open(self.path) as rows:
+                rows.seek(self.rows_start)
+                shutil.copyfileobj(rows, f)
+            f.write(self._end)
+        os.rename(report, self.path)
 
 
 class GaiaTestOptions(MarionetteTestOptions):
@@ -57,17 +404,78 @@ class GaiaTestOptions(MarionetteTestOptions):
                          dest='restart',
                          default=False,
                          help='restart target instance between tests')
+        group.add_option('--snapshot',
+                         action='store_true',
+                         dest='snapshot',
+                         default=False,
+                         help='with --restart, restore the data of the target from a snapshot taken '
+                              'when it first starts cleanly instead of removing it')
         group.add_option('--html-output',
                          action='store',
                          dest='html_output',
                          help='html output')
+        group.add_option('--in-page-waits',
+                         action='store_true',
+                         dest='in_page_waits',
+                         default=False,
+                         help='wait for elements with a single in-page script instead of polling; an element '
+                              'counts as displayed there when neither it nor an ancestor is hidden by display, '
+                              'visibility or opacity and it has a size, rather than by the is_displayed check '
+                              'of Marionette')
+        group.add_option('--durations',
+                         action='store',
+                         dest='durations',
+                         help='file to keep test durations in, used to run the longest tests first '
+                              'when sharing the tests across several targets; defaults to %s when '
+                              'sharing them, and to keeping none otherwise' % TestDurations.default_path)
+        group.add_option('--trace-commands',
+                         action='store',
+                         dest='trace_commands',
+                         help='record every Marionette command in this file and summarize them per test '
+                              'in the html output')
+        address = self.get_option('--address')
+        address.help = '%s; give a comma separated list to share the tests across several targets, ' \
+                       'prefixing an entry with serial@ to select an adb device' % address.help
 
 class GaiaTestRunner(MarionetteTestRunner):
 
-    def __init__(self, html_output=None, **kwargs):
+    def __init__(self, html_output=None, in_page_waits=False, shard=None, durations=None,
+                 trace_commands=None, **kwargs):
+        address = kwargs.get('address')
+        self.devices = address and ',' in address and address.split(',') or []
+        if self.devices:
+            kwargs['address'] = None
+            durations = durations or TestDurations.default_path
         MarionetteTestRunner.__init__(self, **kwargs)
         self.textrunnerclass = GaiaTextTestRunner
+        Wait.in_page = in_page_waits
+        self.trace_commands = trace_commands
+        CommandTrace.enabled = bool(trace_commands)
+
+        # the claimed tests, their lock and the queue to report results on when
+        # running as one of several shards
+        self.shard = shard
+        self.shard_kwargs = dict(kwargs, in_page_waits=in_page_waits, durations=durations,
+                                 trace_commands=trace_commands, xml_output=None)
+        self.durations = TestDurations(durations)
+
+        # test files found while collecting the tests of a shard, and the
+        # number of tests the manifests skipped
+        self.collected = None
+        self.skipped = 0
+        self.shard_kwargs.pop('address', None)
+
+        if shard is None:
+            self.confirm_destructive_run()
+
+        # for HTML output
+        self.html_output = html_output
+        self.testvars['html_output'] = self.html_output
+        self.html_report = None
+        self.reported = 0
+        self.results = []
 
+    def confirm_destructive_run(self):
         width = 80
         if not self.testvars.get('acknowledged_risks') is True:
             url = 'https://developer.mozilla.org/en-US/docs/Gaia_Test_Runner#Risks'
@@ -100,137 +508,150 @@ class GaiaTestRunner(MarionetteTestRunner):
                 exit()
             print 'Continuing with test run...\n'
 
-        # for HTML output
-        self.html_output = html_output
-        self.testvars['html_output'] = self.html_output
-        self.results = []
-
     def register_handlers(self):
         self.test_handlers.extend([GaiaTestCase])
 
     def run_tests(self, tests):
-        MarionetteTestRunner.run_tests(self, tests)
-
-        if self.html_output:
-            # change default encoding to avoid encoding problem for page source
-            reload(sys)
-            sys.setdefaultencoding('utf-8')
-            html_dir = os.path.dirname(os.path.abspath(self.html_output))
-            if not os.path.exists(html_dir):
-                os.makedirs(html_dir)
-            with open(self.html_output, 'w') as f:
-                f.write(self.generate_html(self.results))
-
-    def generate_html(self, results_list):
-
-        def failed_count(results):
-            count = len(results.failures)
-            if hasattr(results, 'unexpectedSuccesses'):
-                count += len(results.unexpectedSuccesses)
-            return count
-
-        tests = sum([results.testsRun for results in results_list])
-        failures = sum([failed_count(results) for results in results_list])
-        skips = sum([len(results.skipped) + len(results.expectedFailures) for results in results_list])
-        errors = sum([len(results.errors) for results in results_list])
-        passes = 0
-        test_time = self.elapsedtime.total_seconds()
-        test_logs = []
-
-        def _extract_html(test, text='', result='passed', debug=None):
-            cls_name = test.__class__.__name__
-            tc_name = unicode(test).split()[0]
-            tc_time = str(test.duration)
-            additional_html = []
-            links_html = []
-
-            if result in ['failure', 'error', 'skipped']:
-                if debug and debug.get('screenshot'):
-                    screenshot = 'data:image/png;base64,%s' % debug['screenshot']
-                    additional_html.append(
-                        html.div(
-                            html.a(html.img(src=screenshot), href=screenshot), class_='screenshot'))
-                for name, content in debug.items():
-                    try:
-                        if 'screenshot' in name:
-                            links_html.append(html.a(name, href='data:image/png;base64,%s' % content.encode('us-ascii')))
-                        else:
-                            # use base64 to avoid that some browser(such as Firefox, Opera) treats '#' as the start of another link if the data URL contains.
-                            # use 'charset=utf-8' to show special characters like Chinese.
-                            links_html.append(html.a(name, href='data:text/plain;charset=utf-8;base64,%s' % base64.b64encode(content)))
-                        links_html.append(' ')
-                    except:
-                        pass
-
-                log = html.div(class_=result)
-                for line in text.splitlines():
-                    separator = line.startswith(' ' * 10)
-                    if separator:
-                        log.append(line[:80])
-                    else:
-                        if line.lower().find("error") != -1 or line.lower().find("exception") != -1:
-                            log.append(html.span(raw(cgi.escape(line)), class_='error'))
-                        else:
-                            log.append(raw(cgi.escape(line)))
-                    log.append(html.br())
-                additional_html.append(log)
-
-            test_logs.append(html.tr([
-                html.td(result, class_='col-result'),
-                html.td(cls_name, class_='col-class'),
-                html.td(tc_name, class_='col-name'),
-                html.td(tc_time, class_='col-duration'),
-                html.td(links_html, class_='col-links'),
-                html.td(additional_html, class_='debug')],
-                class_=result.lower() + ' results-table-row'))
-
-        for results in results_list:
-            for test in results.tests_passed:
-                _extract_html(test)
-                passes = passes + 1
-            for result in results.failures:
-                _extract_html(result[0], text=result[1], result='failure', debug=result[2])
-            for result in results.errors:
-                _extract_html(result[0], text=result[1], result='error', debug=result[2])
-
-            jquery_src = os.path.abspath(os.path.join(os.path.dirname(__file__), 'resources', 'jquery.js'))
-            main_src = os.path.abspath(os.path.join(os.path.dirname(__file__), 'resources', 'main.js'))
-            style_src = os.path.abspath(os.path.join(os.path.dirname(__file__), 'resources', 'style.css'))
-
-        generated = datetime.datetime.now()
-        doc = html.html(
-            html.head(
-                html.meta(charset='utf-8'),
-                html.title('Test Report'),
-                html.link(rel='stylesheet', href=style_src),
-                html.script(src=jquery_src),
-                html.script(src=main_src)),
-            html.body(
-                html.p('Report generated on %s at %s' % (
-                    generated.strftime('%d-%b-%Y'),
-                    generated.strftime('%H:%M:%S'))),
-                html.table(
-                    html.h2('Summary'),
-                    html.p('%i tests ran. in %i seconds' % (tests, test_time),
-                           html.br(),
-                           html.span('%i passed' % passes, class_='passed'), ', ',
-                           html.span('%i failed' % failures, class_='failed'), ', ',
-                           html.span('%i skipped' % skips, class_='skipped'), ', ',
-                           html.span('%i error' % errors, class_='error'),
-                           html.br()),
-                    html.h2('Results'),
-                    html.table([html.thead(
-                        html.tr([
-                            html.th('Result', class_='sortable', col='result'),
-                            html.th('Class', class_='sortable', col='class'),
-                            html.th('Test Name', class_='sortable', col='name'),
-                            html.th('Duration', class_='sortable numeric', col='duration'),
-                            html.th('Links')]), id='results-table-head'),
-                        html.tbody(test_logs, id='results-table-body')], id='results-table')
-                )
-            )
-        )
-        return doc.unicode(indent=2)
+        if self.html_output and not self.shard:
+            self.html_report = HTMLReportWriter(self.html_output)
+
+        if self.devices:
+            self.run_sharded_tests(tests)
+        else:
+            if self.shard:
+                tests = self.durations.schedule(self.collect_tests(tests))
+            MarionetteTestRunner.run_tests(self, tests)
+
+        # shards leave recording the durations to the runner that started them
+        if self.durations.path and not self.shard:
+            self.durations.update(self.results)
+            self.durations.save()
+
+        GaiaDevice.save_resource_caches()
+
+        if not self.shard:
+            for serial, cache_stats in sorted(GaiaDevice.resource_cache_stats.items()):
+                print '\nResource cache%s: %d hits, %d misses' % (
+                    serial and ' of %s' % serial, cache_stats['hits'], cache_stats['misses'])
+
+        if GaiaTestCase.settings_drift and not self.shard:
+            print '\nSettings changed by tests:'
+            for test_id, names in sorted(GaiaTestCase.settings_drift.items()):
+                print '%s: %s' % (test_id, ', '.join(names))
+
+        if GaiaTestCase.phase_timings and not self.shard:
+            print '\nSetup phases (seconds):'
+            for phase, summary in summarize_phases(GaiaTestCase.phase_timings).items():
+                print '%s: total %.2f, median %.2f, p90 %.2f, max %.2f over %d tests' % (
+                    phase, summary['total'], summary['median'], summary['p90'], summary['max'], summary['tests'])
+
+        commands = None
+        if self.trace_commands and not self.shard:
+            CommandTrace.save(self.trace_commands)
+            commands = CommandTrace.summarize(CommandTrace.commands)
+
+        if self.html_report:
+            self.report_results()
+            self.html_report.finish(self.elapsedtime, commands, GaiaTestCase.phase_timings)
+
+    def collect_tests(self, tests):
+        """Expands directories and manifests into the test files they run."""
+        self.collected = []
+        todo = self.todo
+        for test in tests:
+            self.run_test(test)
+        # manifests count the tests they skip as todo, which run_tests resets
+        self.skipped = self.todo - todo
+        collected, self.collected = self.collected, None
+        return collected
+
+    def run_test(self, test):
+        if self.collected is not None and os.path.isfile(test) and not test.endswith('.ini'):
+            self.collected.append(os.path.abspath(test))
+            return
+        if self.shard and os.path.isfile(test) and not test.endswith('.ini'):
+            claimed, lock, queue = self.shard
+            path = os.path.abspath(test)
+            with lock:
+                if path in claimed:
+                    return
+                claimed[path] = self.address
+        MarionetteTestRunner.run_test(self, test)
+        self.report_results()
+
+    def report_results(self):
+        """Adds the results not yet reported to the HTML report, or sends them to
+        the runner that started this shard, then keeps only what the XML report
+        and the durations need of them."""
+        for index in range(self.reported, len(self.results)):
+            results = self.results[index]
+            if self.shard:
+                self.shard[2].put(('results', ShardResults.summarize(results)))
+            elif self.html_report:
+                self.html_report.add_results(results)
+            self.results[index] = ShardResults(ShardResults.summarize(results, debug=False))
+        self.reported = len(self.results)
+
+    def run_sharded_tests(self, tests):
+        # every shard walks the same tests and runs those no other shard has
+        # claimed yet, so the targets share one queue of work
+        self.reset_test_stats()
+        starttime = datetime.datetime.utcnow()
+        manager = multiprocessing.Manager()
+        claimed = manager.dict()
+        lock = manager.Lock()
+        queue = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=run_shard,
+                                           args=(address, tests, self.shard_kwargs, claimed, lock, queue))
+                   for address in self.devices]
+        for worker in workers:
+            worker.start()
+
+        # shards send the results of each test file as it finishes, which are
+        # reported straight away, and their totals once they are done
+        reports = []
+        while len(reports) < len(workers):
+            try:
+                message = queue.get(timeout=5)
+            except Queue.Empty:
+                if not any(worker.is_alive() for worker in workers) and queue.empty():
+                    break
+                continue
+            if message[0] == 'results':
+                self.results.append(ShardResults(message[1]))
+                self.report_results()
+            else:
+                reports.append(message[1:])
+        for worker in workers:
+            worker.join()
+
+        if len(reports) < len(workers):
+            self.logger.error('%d of %d shards did not report results' % (len(workers) - len(reports), len(workers)))
+            self.failed += len(workers) - len(reports)
+
+        # every shard walks the same manifests, so each counted the same skipped tests
+        self.todo += max([report[3] for report in reports] or [0])
+        for passed, failed, todo, skipped, commands, phase_timings, cache_stats, settings_drift in reports:
+            CommandTrace.commands.extend(commands)
+            GaiaTestCase.phase_timings.update(phase_timings)
+            GaiaDevice.resource_cache_stats.update(cache_stats)
+            GaiaTestCase.settings_drift.update(settings_drift)
+            self.passed += passed
+            self.failed += failed
+            self.todo += todo
+
+        self.logger.info('\nSUMMARY\n-------')
+        self.logger.info('passed: %d' % self.passed)
+        self.logger.info('failed: %d' % self.failed)
+        self.logger.info('todo: %d' % self.todo)
+        self.elapsedtime = datetime.datetime.utcnow() - starttime
+
+        if self.xml_output:
+            xml_dir = os.path.dirname(os.path.abspath(self.xml_output))
+            if not os.path.exists(xml_dir):
+                os.makedirs(xml_dir)
+            with open(self.xml_output, 'w') as f:
+                f.write(self.generate_xml(self.results))
 
 
 class GaiaTextTestRunner(MarionetteTextTestRunner):
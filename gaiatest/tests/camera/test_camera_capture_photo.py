@@ -7,6 +7,8 @@ from gaiatest import GaiaTestCase
 
 class TestCamera(GaiaTestCase):
 
+    creates_media = True
+
     _capture_button_locator = ('id', 'capture-button')
     _focus_ring = ('id', 'focus-ring')
     _video_mode_locator = ('css selector', 'body.video')
@@ -7,6 +7,8 @@ from gaiatest import GaiaTestCase
 
 class TestCamera(GaiaTestCase):
 
+    creates_media = True
+
     _capture_button_locator = ('id', 'capture-button')
     # This is a workaround for the Bug 832045
     _capture_button_enabled_locator = ('css selector', '#capture-button:not([disabled])')
@@ -7,6 +7,8 @@ from gaiatest import GaiaTestCase
 
 class TestCameraMultipleShots(GaiaTestCase):
 
+    creates_media = True
+
     # Camera application locators
     _capture_button_locator = ('id', 'capture-button')
     _capture_button_enabled_locator = ('css selector', '#capture-button:not([disabled])')
@@ -25,7 +25,8 @@ class TestClockTurnOnOffAlarm(GaiaTestCase):
         https://moztrap.mozilla.org/manage/case/1779/
         """
 
-        alarm = self.clock.alarms[0]
+        # the alarm itself rather than a snapshot, as its state is read again
+        alarm = self.clock.alarms[0].region
 
         # turn on the alarm
         origin_alarm_checked = alarm.is_alarm_active
@@ -16,9 +16,8 @@ class TestContacts(GaiaTestCase):
         GaiaTestCase.setUp(self)
 
         # insert contacts by given names
-        for contact_name in self._contacts_name_list:
-            contact = MockContact(givenName=contact_name[0], familyName=contact_name[1])
-            self.data_layer.insert_contact(contact)
+        self.data_layer.insert_contacts([MockContact(givenName=contact_name[0], familyName=contact_name[1])
+                                         for contact_name in self._contacts_name_list])
         # prepare the sorted-by-first-name and sorted-by-last-name lists
         self.sorted_contacts_name_by_first = sorted(self._contacts_name_list, key=lambda name: name[0])
         self.sorted_contacts_name_by_last = sorted(self._contacts_name_list, key=lambda name: name[1])
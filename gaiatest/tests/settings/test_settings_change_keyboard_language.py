@@ -50,6 +50,7 @@ class TestChangeKeyboardLanguage(GaiaTestCase):
 
         # Switch to keyboard frame and switch language
         keyboard_app.switch_keyboard_language("es")
+        self.marionette.switch_to_frame()
         keybframe = self.marionette.find_element(*self._select_keyb_frame_locator)
         self.marionette.switch_to_frame(keybframe, focus=False)
         self.wait_for_element_displayed(*self._special_key_locator)
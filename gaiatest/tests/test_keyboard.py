@@ -43,3 +43,13 @@ class TestKeyboard(GaiaTestCase):
         output_text = contact_details.comments
 
         self.assertEqual(self._string[:14] + ' ' + self._string[15:] + 'Æ'.decode("UTF-8"), output_text)
+
+    def test_keyboard_fast_typing(self):
+        contacts_app = Contacts(self.marionette)
+        contacts_app.launch()
+
+        new_contact_form = contacts_app.tap_new_contact()
+        new_contact_form.type_comment('')
+
+        # send checks the value of the comment field once all keys are tapped
+        self.keyboard.send(self._string, fast=True)
@@ -0,0 +1,30 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import sys
+
+from gaiatest import GaiaTestCase
+from gaiatest import CommandTrace
+from gaiatest.apps.contacts.app import Contacts
+
+
+class TestCommandTrace(GaiaTestCase):
+
+    def test_waits_credited_to_page_object(self):
+        callers = []
+        send_message = self.marionette._send_message
+
+        def traced(*args, **kwargs):
+            callers.append(CommandTrace._caller(sys._getframe(1)))
+            return send_message(*args, **kwargs)
+
+        self.marionette._send_message = traced
+        try:
+            Contacts(self.marionette).launch()
+        finally:
+            del self.marionette._send_message
+
+        waits = [caller for caller, waiting in callers if waiting]
+        self.assertTrue(waits)
+        self.assertEqual(set(waits), set(['Contacts.launch']))
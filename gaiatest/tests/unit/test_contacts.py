@@ -13,3 +13,11 @@ class TestContacts(GaiaTestCase):
         self.assertEqual(len(self.data_layer.all_contacts), 1)
         self.data_layer.remove_all_contacts()
         self.assertEqual(self.data_layer.all_contacts, [])
+
+    def test_insert_and_remove_many_contacts(self):
+        count = 50
+        self.data_layer.insert_contacts([MockContact() for i in range(count)])
+        self.assertEqual(len(self.data_layer.all_contacts), count)
+        self.assertEqual(self.data_layer.contacts_count, count)
+        self.data_layer.remove_all_contacts()
+        self.assertEqual(self.data_layer.all_contacts, [])
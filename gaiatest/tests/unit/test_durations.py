@@ -0,0 +1,51 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+
+from marionette import MarionetteTestCase
+
+from gaiatest.runtests import TestDurations
+from gaiatest.runtests import percentile
+
+
+class TestSchedule(MarionetteTestCase):
+
+    def setUp(self):
+        MarionetteTestCase.setUp(self)
+        self.durations = TestDurations(None)
+        self.durations.durations = {
+            os.path.abspath('test_short.py'): {'test_a': 1, 'test_b': 2},
+            os.path.abspath('test_long.py'): {'test_a': 10},
+            os.path.abspath('test_medium.py'): {'test_a': 4, 'test_b': 4}}
+
+    def test_longest_first(self):
+        self.assertEqual(self.durations.schedule(['test_short.py', 'test_medium.py', 'test_long.py']),
+                         ['test_long.py', 'test_medium.py', 'test_short.py'])
+
+    def test_unknown_files_first(self):
+        self.assertEqual(self.durations.schedule(['test_short.py', 'test_new.py', 'test_long.py', 'test_other.py']),
+                         ['test_new.py', 'test_other.py', 'test_long.py', 'test_short.py'])
+
+    def test_without_history(self):
+        self.assertEqual(TestDurations(None).schedule(['test_b.py', 'test_a.py']), ['test_b.py', 'test_a.py'])
+
+
+class TestPercentile(MarionetteTestCase):
+
+    def test_empty(self):
+        self.assertEqual(percentile([], 50), None)
+
+    def test_single_value(self):
+        self.assertEqual(percentile([3], 50), 3)
+        self.assertEqual(percentile([3], 90), 3)
+        self.assertEqual(percentile([3], 0), 3)
+
+    def test_nearest_rank(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(percentile(values, 50), 3)
+        self.assertEqual(percentile(values, 90), 5)
+        self.assertEqual(percentile(values, 100), 5)
+        self.assertEqual(percentile(values, 20), 1)
+        self.assertEqual(percentile(values, 21), 2)
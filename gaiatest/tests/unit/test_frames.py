@@ -0,0 +1,51 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from gaiatest import GaiaTestCase
+
+
+class TestFrames(GaiaTestCase):
+
+    def test_frame_context(self):
+        app = self.apps.launch('Clock', switch_to_frame=False)
+        self.assertEqual(self.marionette.current_frame, None)
+
+        with self.marionette.frame(app.frame):
+            self.assertEqual(self.marionette.current_frame, app.frame)
+            self.assertTrue('clock' in self.marionette.get_url())
+
+        self.assertEqual(self.marionette.current_frame, None)
+        self.assertTrue('system' in self.marionette.get_url())
+
+    def test_switch_to_current_frame(self):
+        app = self.apps.launch('Clock')
+        self.marionette.switch_to_frame(app.frame)
+        self.assertEqual(self.marionette.current_frame, app.frame)
+        self.assertTrue('clock' in self.marionette.get_url())
+
+    def test_helpers_return_to_frame(self):
+        app = self.apps.launch('Clock')
+        self.data_layer.all_contacts
+        self.assertTrue(self.apps.is_app_installed('Clock'))
+        self.assertEqual(self.marionette.current_frame, app.frame)
+        self.assertTrue('clock' in self.marionette.get_url())
+
+    def test_helpers_return_to_nested_frame(self):
+        app = self.apps.launch('Clock')
+        self.marionette.execute_script("""
+            var frame = document.createElement('iframe');
+            frame.id = 'nested-frame';
+            document.body.appendChild(frame);""")
+        nested_frame = self.marionette.find_element('id', 'nested-frame')
+        self.marionette.switch_to_frame(nested_frame)
+
+        self.data_layer.all_contacts
+        self.assertEqual(self.marionette.current_frame, nested_frame)
+        self.assertEqual(self.marionette.get_url(), 'about:blank')
+
+        # a frame given by index is looked up from the frame selected
+        self.marionette.switch_to_frame()
+        self.marionette.switch_to_frame(app.frame)
+        self.marionette.switch_to_frame(0)
+        self.assertEqual(self.marionette.get_url(), 'about:blank')
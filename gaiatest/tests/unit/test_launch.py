@@ -24,3 +24,10 @@ class TestLaunch(GaiaTestCase):
         warm = self.apps.launch('Clock')
         self.assertEqual(cold, warm)
         self.assertTrue('clock' in self.marionette.get_url())
+
+    def test_launch_reports_load_time(self):
+        app = self.apps.launch('Clock')
+        self.assertTrue(app.load_time['time'] > 0)
+        self.assertTrue(app.launch_time > 0)
+        displayed = self.apps.launch('Clock')
+        self.assertEqual(displayed.load_time, None)
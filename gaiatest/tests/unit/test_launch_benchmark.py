@@ -0,0 +1,39 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from marionette import MarionetteTestCase
+
+from gaiatest.launch_benchmark import LaunchBenchmark
+
+
+class TestLaunchBenchmark(MarionetteTestCase):
+
+    def summary(self, median):
+        return {'Clock': {'cold': {'load_time': {'samples': 5, 'median': median, 'p90': median, 'stddev': 0}}}}
+
+    def test_summarize(self):
+        summary = LaunchBenchmark.summarize({'Clock': {
+            'cold': [{'load_time': 300, 'launch_time': 400},
+                     {'load_time': 100, 'launch_time': None},
+                     {'load_time': 200, 'launch_time': 600}],
+            'warm': [{'load_time': None, 'launch_time': None}]}})
+
+        self.assertEqual(summary['Clock']['cold']['load_time'],
+                         {'samples': 3, 'median': 200, 'p90': 300, 'stddev': (20000 / 3.0) ** 0.5})
+        self.assertEqual(summary['Clock']['cold']['launch_time']['samples'], 2)
+        self.assertEqual(summary['Clock']['cold']['launch_time']['median'], 400)
+        self.assertFalse('warm' in summary['Clock'])
+
+    def test_within_threshold(self):
+        self.assertEqual(LaunchBenchmark.regressions(self.summary(110), self.summary(100), 10), [])
+        self.assertEqual(LaunchBenchmark.regressions(self.summary(90), self.summary(100), 10), [])
+
+    def test_over_threshold(self):
+        self.assertEqual(LaunchBenchmark.regressions(self.summary(111), self.summary(100), 10),
+                         ['Clock cold load_time: median 111ms, baseline 100ms'])
+        self.assertEqual(len(LaunchBenchmark.regressions(self.summary(101), self.summary(100), 0)), 1)
+
+    def test_missing_from_baseline(self):
+        self.assertEqual(LaunchBenchmark.regressions(self.summary(500), {}, 10), [])
+        self.assertEqual(LaunchBenchmark.regressions(self.summary(500), {'Clock': {'warm': {}}}, 10), [])
@@ -0,0 +1,87 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from gaiatest import GaiaTestCase
+from gaiatest.apps.base import PageRegion
+from gaiatest.apps.base import PageRegionList
+from gaiatest.apps.contacts.app import Contacts
+from gaiatest.mocks.mock_contact import MockContact
+
+
+class Row(PageRegion):
+
+    __slots__ = ()
+
+    created = []
+
+    _fields = {'name': (('css selector', '.name'), 'text')}
+
+    def __init__(self, *args, **kwargs):
+        PageRegion.__init__(self, *args, **kwargs)
+        self.created.append(self)
+
+    @property
+    def name(self):
+        return self._field('name')
+
+
+class TestPageRegions(GaiaTestCase):
+
+    def setUp(self):
+        GaiaTestCase.setUp(self)
+        self.data_layer.insert_contacts([MockContact() for i in range(3)])
+        self.contacts_app = Contacts(self.marionette)
+        self.contacts_app.launch()
+
+    def test_snapshot_matches_element_text(self):
+        contacts = self.contacts_app.contacts
+        self.assertEqual(len(contacts), 3)
+
+        for contact in contacts:
+            self.assertEqual(contact.name, contact.region.name)
+            self.assertEqual(contact.full_name, contact.region.full_name)
+
+    def test_snapshot_cannot_change(self):
+        rows = PageRegionList(Row, self.contacts_app, [(None, {'name': 'before'})])
+        row = rows[0]
+
+        self.assertRaises(AttributeError, setattr, row, 'name', 'after')
+        self.assertEqual(row.name, 'before')
+        self.assertTrue(isinstance(row.region, Row))
+
+    def test_regions_created_as_used(self):
+        del Row.created[:]
+        rows = PageRegionList(Row, self.contacts_app,
+                              [(None, {'name': str(i)}) for i in range(5)])
+
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(Row.created, [])
+
+        self.assertEqual(rows[1].name, '1')
+        self.assertEqual(rows[-1].name, '4')
+        self.assertEqual(len(Row.created), 2)
+
+        self.assertEqual([row.name for row in rows[1:3]], ['1', '2'])
+        self.assertEqual([row.name for row in rows[::-2]], ['4', '2', '0'])
+        self.assertEqual(rows[5:], [])
+        self.assertRaises(IndexError, lambda: rows[5])
+
+        self.assertEqual([row.name for row in rows], ['0', '1', '2', '3', '4'])
+        self.assertEqual(len(Row.created), 12)
+
+    def test_regions_share_page_helpers(self):
+        contacts = self.contacts_app.contacts
+
+        self.assertTrue(contacts[0].apps is self.contacts_app.apps)
+        self.assertTrue(contacts[-1].apps is contacts[0].apps)
+        self.assertTrue(Row(self.marionette, None).apps is not self.contacts_app.apps)
+
+    def test_app_compares_to_other_types(self):
+        app = self.apps.launch('Contacts')
+
+        self.assertTrue(app == self.apps.launch('Contacts'))
+        self.assertFalse(app != self.apps.launch('Contacts'))
+        self.assertFalse(app == None)
+        self.assertTrue(app != None)
+        self.assertTrue(app != 'Contacts')
@@ -0,0 +1,32 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from gaiatest import GaiaTestCase
+
+
+class TestSession(GaiaTestCase):
+
+    # session and helpers seen by the first test
+    first = None
+
+    def test_1_first_test(self):
+        TestSession.first = (self.marionette.session, self.apps, self.data_layer)
+
+    def test_2_session_kept(self):
+        if self.restart:
+            self.skipTest('the session is restarted for every test')
+        session, apps, data_layer = TestSession.first
+        self.assertEqual(self.marionette.session, session)
+        self.assertTrue(self.apps is apps)
+        self.assertTrue(self.data_layer is data_layer)
+
+    def test_3_app_frame_left_selected(self):
+        self.data_layer.set_setting('keyboard.layouts.spanish', True)
+        self.apps.launch('Clock')
+        self.assertTrue('clock' in self.marionette.get_url())
+
+    def test_4_clean_up_after_app_frame(self):
+        self.assertEqual(self.marionette.current_frame, None)
+        self.assertFalse(self.data_layer.get_setting('keyboard.layouts.spanish'))
+        self.assertTrue('system' in self.marionette.get_url())
@@ -48,6 +48,7 @@ setup(name='gaiatest',
       # -*- Entry points: -*-
       [console_scripts]
       gaiatest = gaiatest.runtests:main
+      gaiatest-launch-benchmark = gaiatest.launch_benchmark:main
       """,
       install_requires=deps,
       )